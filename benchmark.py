@@ -0,0 +1,340 @@
+"""
+Offline end-to-end benchmark of the PDF-to-video pipeline.
+Replays the PDFs in uploads/ through MathVideoAgent.process_pdf and renders
+known-good scenes from code/ through create_video, with a deterministic stub
+in place of the LLM so no API calls are made. Reports p50/p95 per stage,
+renders per minute at the requested concurrency and peak RSS of the process
+tree, and saves the results as JSON for comparison between versions.
+
+    python benchmark.py --renders 8 --concurrency 2 --quality -ql
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+REPO_DIR = Path(__file__).resolve().parent
+logger = logging.getLogger("benchmark")
+
+
+class StubLLM:
+    """Deterministic stand-in for LLMGateway: canned concepts and known-good scenes"""
+
+    def __init__(self, scenes: List[str], latency: float = 0.0, chunk_chars: int = 64):
+        self.scenes = scenes
+        self.latency = latency  # seconds per request, to model a remote API
+        self.chunk_chars = chunk_chars
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(messages: List[Dict]) -> int:
+        return int(hashlib.sha256(messages[-1]['content'].encode('utf-8')).hexdigest()[:8], 16)
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def chat(self, messages: List[Dict], temperature: float, model: Optional[str] = None,
+             use_cache: bool = True) -> str:
+        """Concepts as a JSON array for analysis prompts, a fixed answer otherwise"""
+        self._count()
+        time.sleep(self.latency)
+        if 'identifies content' not in messages[0]['content']:
+            return "This is a benchmark answer."
+        seed = self._digest(messages)
+        concepts = [{
+            'title': f"Concept {(seed + i) % 97}",
+            'type': 'visualization',
+            'description': "Benchmark concept derived from the document chunk.",
+            'complexity': 'basic',
+            'estimated_duration': 60,
+            'key_concepts': ['benchmark'],
+        } for i in range(3)]
+        return json.dumps(concepts)
+
+    def stream_chat(self, messages: List[Dict], temperature: float, model: Optional[str] = None,
+                    use_cache: bool = True, complete: Optional[Callable[[], bool]] = None) -> Iterator[str]:
+        """A known-good scene chosen by the prompt, streamed in a code fence"""
+        self._count()
+        time.sleep(self.latency)
+        code = self.scenes[self._digest(messages) % len(self.scenes)]
+        response = f"Here is the scene:\n```python\n{code}\n```\n"
+        for start in range(0, len(response), self.chunk_chars):
+            yield response[start:start + self.chunk_chars]
+
+    def invalidate(self, messages: List[Dict], temperature: float, model: Optional[str] = None) -> bool:
+        return False
+
+    def stats(self) -> Dict:
+        return {'calls': self.calls, 'stub': True}
+
+
+class StageRecorder:
+    """Collects durations per stage across concurrent runs"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+        self._active = threading.local()  # stages being timed on this thread
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, obj, name: str, stage: str):
+        """Time every call of obj.name as the given stage; calls nested in the same stage are not counted again"""
+        method = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            active = self._active.__dict__.setdefault('stages', set())
+            if stage in active:
+                return method(*args, **kwargs)
+            active.add(stage)
+            start = time.monotonic()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                active.discard(stage)
+                self.add(stage, time.monotonic() - start)
+        setattr(obj, name, timed)
+
+    def progress(self) -> Callable[..., None]:
+        """on_progress callback timing each create_video stage until the next one starts"""
+        state = {'stage': None, 'started': 0.0}
+
+        def report(stage: str, **details):
+            now = time.monotonic()
+            if state['stage'] and state['stage'] != stage:
+                self.add(state['stage'], now - state['started'])
+            if state['stage'] != stage:
+                state['stage'], state['started'] = stage, now
+        report.finish = lambda: report('finished')
+        return report
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {stage: summarize(values) for stage, values in sorted(self.samples.items())}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'max': max(values),
+        'total': sum(values),
+    }
+
+
+class RSSSampler:
+    """Peak resident memory of this process and all its descendants, sampled from /proc"""
+
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="rss-sampler", daemon=True)
+
+    @staticmethod
+    def tree_rss() -> int:
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        children = defaultdict(list)
+        rss = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue  # exited while listing
+            pid = int(entry)
+            children[int(fields[1])].append(pid)  # ppid
+            rss[pid] = int(fields[21]) * page_size
+        total, pending = 0, [os.getpid()]
+        while pending:
+            pid = pending.pop()
+            total += rss.get(pid, 0)
+            pending.extend(children.get(pid, []))
+        return total
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.tree_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.isdir('/proc'):
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def report(self) -> Dict:
+        # ru_maxrss is in kilobytes on Linux
+        return {
+            'tree_peak_bytes': self.peak_bytes,
+            'self_max_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            'children_max_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--pdfs', nargs='*', type=Path,
+                        help="PDFs to process (default: uploads/*.pdf)")
+    parser.add_argument('--scenes', nargs='*', type=Path,
+                        help="known-good scene files the stub LLM returns (default: code/*.py)")
+    parser.add_argument('--renders', type=int, default=4, help="number of create_video calls")
+    parser.add_argument('--concurrency', type=int, default=2, help="concurrent create_video calls")
+    parser.add_argument('--quality', default='-ql', help="Manim quality flag for renders")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="simulated seconds per LLM request")
+    parser.add_argument('--render-cache', action='store_true',
+                        help="keep the render cache enabled (repeat renders become cache hits)")
+    parser.add_argument('--workdir', type=Path,
+                        help="directory for caches and output (default: a fresh temporary directory)")
+    parser.add_argument('--output', type=Path,
+                        help="results file (default: benchmarks/<timestamp>_<revision>.json)")
+    parser.add_argument('--verbose', action='store_true', help="show application logs")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict:
+    args = parse_args(argv)
+    pdfs = [path.resolve() for path in (args.pdfs if args.pdfs is not None else sorted((REPO_DIR / 'uploads').glob('*.pdf')))]
+    scene_files = args.scenes if args.scenes else sorted((REPO_DIR / 'code').glob('*.py'))
+    scenes = [path.read_text(encoding='utf-8') for path in scene_files]
+    if not scenes:
+        sys.exit("No scene files to replay; pass --scenes")
+    revision = git_revision()
+    output = (args.output or REPO_DIR / 'benchmarks' /
+              f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{revision}.json").resolve()
+
+    # main.py builds the agent at import time from relative paths, so import it from the work
+    # directory to keep caches and output away from the real ones
+    workdir = (args.workdir or Path(tempfile.mkdtemp(prefix="manim-bench-"))).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_DIR))
+    # Imported before the sampler thread starts, as the app forks its PDF extraction pool on import
+    import main as app_main
+    with RSSSampler() as rss:
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        agent = app_main.agent
+
+        llm = StubLLM(scenes, latency=args.llm_latency)
+        agent.llm = agent.content_analyzer.llm = agent.video_generator.llm = llm
+        if not args.render_cache:
+            agent.video_generator.render_cache = None
+
+        stages = StageRecorder()
+        stages.wrap(agent.pdf_processor, 'extract_pages_parallel', 'pdf_extract')
+        stages.wrap(agent.pdf_processor, 'extract_pages', 'pdf_extract')
+        stages.wrap(agent.content_analyzer, 'analyze_document', 'content_analysis')
+        stages.wrap(agent, 'process_pdf', 'process_pdf')
+
+        concepts, context = [], ""
+        pdf_failures = 0
+        for pdf in pdfs:
+            success, content, pdf_concepts = agent.process_pdf(str(pdf))
+            if not success:
+                pdf_failures += 1
+                logger.warning(f"Processing {pdf.name} failed: {content}")
+                continue
+            concepts.extend(pdf_concepts)
+            context = context or content[:2000]
+        concepts = concepts or [{'title': 'Benchmark scene', 'type': 'visualization',
+                                 'description': 'Replayed known-good scene.', 'complexity': 'basic'}]
+
+        def render(index: int) -> bool:
+            on_progress = stages.progress()
+            start = time.monotonic()
+            success, video_path, message = agent.video_generator.create_video(
+                concepts[index % len(concepts)], context, qualities=[args.quality], on_progress=on_progress
+            )
+            on_progress.finish()
+            stages.add('create_video', time.monotonic() - start)
+            if not success:
+                logger.warning(f"Render {index} failed: {message[-300:]}")
+            return success
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+            outcomes = list(pool.map(render, range(args.renders)))
+        wall = time.monotonic() - started
+
+        if agent.render_pool:
+            agent.render_pool.shutdown()
+
+    succeeded = sum(outcomes)
+    results = {
+        'revision': revision,
+        'timestamp': datetime.now().isoformat(),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'settings': {
+            'pdfs': [pdf.name for pdf in pdfs],
+            'scenes': [path.name for path in scene_files],
+            'renders': args.renders,
+            'concurrency': args.concurrency,
+            'quality': args.quality,
+            'llm_latency': args.llm_latency,
+            'render_cache': args.render_cache,
+            'warm_workers': agent.render_pool is not None,
+        },
+        'pdfs': {'processed': len(pdfs) - pdf_failures, 'failed': pdf_failures, 'concepts': len(concepts)},
+        'renders': {
+            'succeeded': succeeded,
+            'failed': len(outcomes) - succeeded,
+            'wall_seconds': wall,
+            'renders_per_minute': succeeded / wall * 60 if wall else 0.0,
+        },
+        'stages': stages.summary(),
+        'memory': rss.report(),
+        'llm_calls': llm.calls,
+    }
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(json.dumps({'renders': results['renders'], 'memory': results['memory'],
+                      'stages': {stage: {k: round(v, 3) for k, v in summary.items() if k in ('p50', 'p95')}
+                                 for stage, summary in results['stages'].items()}}, indent=2))
+    print(f"Results saved to {output}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
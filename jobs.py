@@ -0,0 +1,470 @@
+"""
+Background render jobs for the Math Video AI Agent.
+Video generation is handed to a bounded pool of worker threads so that
+Flask request threads return immediately with a job id. Jobs keep an
+ordered log of stage events that clients can follow while they run. Batches
+group jobs and release them to the queue a few at a time. Lower priority
+values run first, and within a priority the owner with the fewest running
+jobs goes next so one session cannot starve the others. Admission control
+bounds how many jobs may wait; speculative work is cancelled when the queue
+gets busy.
+"""
+
+import itertools
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RENDERING = 'rendering'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+PRIORITY_NORMAL = 0  # someone is waiting for the result, e.g. a preview
+PRIORITY_FINAL = 5  # full quality upgrade of a video the user can already watch
+PRIORITY_SPECULATIVE = 10  # work nobody asked for yet, dropped when real requests need the workers
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's task to stop it after cancel() was requested"""
+
+
+class RenderJob:
+    """A single unit of work tracked by the job queue"""
+
+    def __init__(self, task: Callable[['RenderJob'], Dict], description: str = '', priority: int = PRIORITY_NORMAL,
+                 owner: str = ''):
+        self.id = uuid.uuid4().hex
+        self.task = task
+        self.description = description
+        self.priority = priority
+        self.owner = owner  # session the job is for, used for fair sharing of workers
+        self.sequence = 0  # submission order, set by the queue
+        self.after: Optional['RenderJob'] = None  # job that must finish before this one may start
+        self.cancel_requested = False
+        self.cancel_reason = ''
+        self.status = JOB_QUEUED
+        self.result: Dict = {}
+        self.error = ''
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.stage = JOB_QUEUED
+        self.progress: Dict = {}
+        self.events: List[Dict] = []
+        self.timings: Dict[str, float] = {}  # seconds spent in each stage
+        self._stage_started: Optional[float] = None
+        self._changed = threading.Condition()
+        self._callbacks: List[Callable[['RenderJob'], None]] = []
+        self.report(JOB_QUEUED)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    def cancel(self, reason: str = '') -> bool:
+        """Cancel a queued job outright, or ask a running one to stop at its next check_cancelled()"""
+        with self._changed:
+            if self.finished:
+                return False
+            self.cancel_requested = True
+            self.cancel_reason = reason
+            if self.status != JOB_QUEUED:
+                return True
+            self.status = JOB_CANCELLED
+            self.error = reason
+            self.finished_at = datetime.now()
+            self.report(JOB_CANCELLED, reason=reason)
+        logger.info(f"Cancelled queued job {self.id} ({self.description}): {reason}")
+        self._run_callbacks()
+        return True
+
+    def check_cancelled(self):
+        """Called by tasks between steps; raises JobCancelled if cancel() was requested"""
+        if self.cancel_requested:
+            raise JobCancelled(self.cancel_reason or "cancelled")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job has finished; returns whether it did within timeout"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished, timeout)
+
+    def report(self, stage: str, **details):
+        """Record a stage transition or progress update and wake any listeners"""
+        with self._changed:
+            now = time.monotonic()
+            if self._stage_started is not None:
+                self.timings[self.stage] = self.timings.get(self.stage, 0.0) + now - self._stage_started
+            self._stage_started = None if stage in (JOB_DONE, JOB_FAILED, JOB_CANCELLED) else now
+            self.stage = stage
+            self.progress = details
+            self.events.append({
+                'id': len(self.events) + 1,
+                'stage': stage,
+                'time': datetime.now().isoformat(),
+                **details
+            })
+            self._changed.notify_all()
+
+    def add_done_callback(self, callback: Callable[['RenderJob'], None]):
+        """Call callback with the job once it has finished, or right away if it already has"""
+        with self._changed:
+            if not self.finished:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _run_callbacks(self):
+        with self._changed:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error(f"Callback of job {self.id} failed: {e}", exc_info=True)
+
+    def count_events(self, stage: str) -> int:
+        """How many times the job entered a stage"""
+        with self._changed:
+            return sum(1 for event in self.events if event['stage'] == stage)
+
+    def wait_for_events(self, after: int, timeout: float) -> List[Dict]:
+        """Events with an id greater than after, waiting up to timeout for the next one"""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > after, timeout)
+            return self.events[after:]
+
+    def to_dict(self) -> Dict:
+        """Public view of the job used by the status endpoints"""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'priority': self.priority,
+            'progress': self.progress,
+            'timings': {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            'description': self.description,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class RenderBatch:
+    """Jobs submitted together, of which at most max_parallel are queued or running at once"""
+
+    def __init__(self, tasks: List[Tuple[Callable[[RenderJob], Dict], str]], max_parallel: int, owner: str = '',
+                 after: Optional[List[Optional[RenderJob]]] = None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.after = after or [None] * len(tasks)  # per task, a job it must wait for
+        self.size = len(tasks)
+        self.max_parallel = max(1, max_parallel)
+        self.created_at = datetime.now()
+        self.job_ids: List[Optional[str]] = [None] * len(tasks)  # filled in as tasks are released
+        self.items: List[Dict] = []  # caller's view of the batch, e.g. requested items mapped to tasks
+        self._pending = deque(enumerate(tasks))
+        self._running = 0
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        with self._lock:
+            return not self._pending and self._running == 0
+
+    @property
+    def backlog(self) -> int:
+        """Tasks not yet released to the queue"""
+        with self._lock:
+            return len(self._pending)
+
+    def _release(self, submit: Callable[..., RenderJob]):
+        """Submit pending tasks while below the parallelism limit"""
+        while True:
+            with self._lock:
+                if not self._pending or self._running >= self.max_parallel:
+                    return
+                index, (task, description) = self._pending.popleft()
+                self._running += 1
+            job = submit(task, description, owner=self.owner, after=self.after[index])
+            self.job_ids[index] = job.id
+            job.add_done_callback(lambda job: self._finished(submit))
+
+    def _finished(self, submit: Callable[..., RenderJob]):
+        with self._lock:
+            self._running -= 1
+        self._release(submit)
+
+
+class RenderJobQueue:
+    """Priority job queue (FIFO within a priority) drained by a fixed pool of worker threads"""
+
+    def __init__(self, workers: int, max_finished_jobs: int = 500, max_queued: int = 0,
+                 max_queued_per_owner: int = 0):
+        self.workers = max(1, workers)
+        self.max_finished_jobs = max_finished_jobs
+        self.max_queued = max_queued  # waiting jobs before new requests are refused, 0 for no limit
+        self.max_queued_per_owner = max_queued_per_owner  # 0 for no limit
+        self._pending: List[RenderJob] = []
+        self._sequence = itertools.count()  # keeps FIFO order within a priority
+        self._running = 0
+        self._running_by_owner: Dict[str, int] = {}  # excludes speculative jobs, which nobody asked for
+        self._owner_counted: Set[str] = set()  # ids of running jobs included in _running_by_owner
+        self._last_served: Dict[str, int] = {}  # owner -> turn it last got a worker, for round robin
+        self._turns = itertools.count()
+        self._service_seconds = 60.0  # moving average of job run time, for Retry-After estimates
+        self._jobs: Dict[str, RenderJob] = {}
+        self._batches: Dict[str, RenderBatch] = {}
+        self._lock = threading.Lock()
+        self._work_ready = threading.Condition(self._lock)
+        self._threads: List[threading.Thread] = []
+
+        logger.info(f"Starting render job queue with {self.workers} workers")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"render-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def admit(self, owner: str = '', priority: int = PRIORITY_NORMAL) -> Tuple[bool, int, str]:
+        """Whether another job may be queued for owner; returns admitted, Retry-After seconds, and message.
+
+        Only a hint, as other requests may queue jobs before this caller does;
+        try_submit() checks and enqueues atomically.
+        """
+        with self._lock:
+            return self._admission(owner, priority)
+
+    def _admission(self, owner: str, priority: int) -> Tuple[bool, int, str]:
+        """admit() with the lock held"""
+        # Only jobs that would run ahead of the new one count; background upgrades and
+        # speculation waiting behind it must not push a preview into a 429
+        ahead = [job for job in self._pending
+                 if job.status == JOB_QUEUED and job.priority <= priority]
+        waiting = len(ahead)
+        own = sum(1 for job in ahead if job.owner == owner) if owner else 0
+        # Batch tasks not yet released will be queued at normal priority
+        if priority >= PRIORITY_NORMAL:
+            for batch in self._batches.values():
+                backlog = batch.backlog
+                waiting += backlog
+                if owner and batch.owner == owner:
+                    own += backlog
+        # Roughly when a worker frees up for the next job
+        retry_after = min(600, max(1, math.ceil(self._service_seconds * (waiting // self.workers + 1))))
+        if self.max_queued and waiting >= self.max_queued:
+            logger.warning(f"Refusing job: {waiting} jobs queued (limit {self.max_queued})")
+            return False, retry_after, f"The server is busy, please try again in {retry_after} seconds"
+        if self.max_queued_per_owner and own >= self.max_queued_per_owner:
+            logger.warning(f"Refusing job for {owner[:8]}: {own} of its jobs queued")
+            return False, retry_after, (f"You already have {own} videos waiting, "
+                                        f"please try again in {retry_after} seconds")
+        return True, 0, "Admitted"
+
+    def submit(self, task: Callable[[RenderJob], Dict], description: str = '',
+               priority: int = PRIORITY_NORMAL, owner: str = '', after: Optional[RenderJob] = None) -> RenderJob:
+        """Enqueue a task and return its job handle immediately.
+
+        A job submitted after another stays queued, without taking a worker,
+        until that job has finished.
+        """
+        job, _, _ = self._submit(task, description, priority, owner, after, check_admission=False)
+        return job
+
+    def try_submit(self, task: Callable[[RenderJob], Dict], description: str = '',
+                   priority: int = PRIORITY_NORMAL, owner: str = '',
+                   after: Optional[RenderJob] = None) -> Tuple[Optional[RenderJob], int, str]:
+        """Admit and enqueue a task in one step; returns the job (None if refused), Retry-After seconds, and message"""
+        return self._submit(task, description, priority, owner, after, check_admission=True)
+
+    def _submit(self, task: Callable[[RenderJob], Dict], description: str, priority: int, owner: str,
+                after: Optional[RenderJob], check_admission: bool) -> Tuple[Optional[RenderJob], int, str]:
+        with self._work_ready:
+            if check_admission:
+                admitted, retry_after, message = self._admission(owner, priority)
+                if not admitted:
+                    return None, retry_after, message
+            job = RenderJob(task, description, priority, owner)
+            job.after = after
+            self._jobs[job.id] = job
+            self._prune_finished()
+            busy = self._running >= self.workers
+            job.sequence = next(self._sequence)
+            self._pending.append(job)
+            depth = len(self._pending)
+            self._work_ready.notify()
+        logger.info(f"Queued job {job.id} ({description}), queue depth: {depth}")
+        if after is not None:
+            after.add_done_callback(lambda _: self._notify_workers())
+        if busy and priority < PRIORITY_SPECULATIVE:
+            self.cancel_speculative("workers busy")
+        return job, 0, "Queued"
+
+    def cancel_speculative(self, reason: str) -> int:
+        """Cancel all queued and running speculative jobs; returns how many were cancelled"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values()
+                    if job.priority >= PRIORITY_SPECULATIVE and not job.finished]
+        cancelled = sum(1 for job in jobs if job.cancel(reason))
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} speculative jobs: {reason}")
+        return cancelled
+
+    def submit_batch(self, tasks: List[Tuple[Callable[[RenderJob], Dict], str]],
+                     max_parallel: int, owner: str = '',
+                     after: Optional[List[Optional[RenderJob]]] = None) -> RenderBatch:
+        """Enqueue (task, description) pairs a few at a time and return the batch handle"""
+        batch, _, _ = self._submit_batch(tasks, max_parallel, owner, after, check_admission=False)
+        return batch
+
+    def try_submit_batch(self, tasks: List[Tuple[Callable[[RenderJob], Dict], str]],
+                         max_parallel: int, owner: str = '',
+                         after: Optional[List[Optional[RenderJob]]] = None) -> Tuple[Optional[RenderBatch], int, str]:
+        """Admit and enqueue a batch in one step; returns the batch (None if refused), Retry-After seconds, and message"""
+        return self._submit_batch(tasks, max_parallel, owner, after, check_admission=True)
+
+    def _submit_batch(self, tasks: List[Tuple[Callable[[RenderJob], Dict], str]], max_parallel: int, owner: str,
+                      after: Optional[List[Optional[RenderJob]]],
+                      check_admission: bool) -> Tuple[Optional[RenderBatch], int, str]:
+        if self.max_queued_per_owner:
+            # A batch must not queue more at once than a session may have waiting
+            max_parallel = min(max_parallel, self.max_queued_per_owner)
+        batch = RenderBatch(tasks, max_parallel, owner, after)
+        with self._lock:
+            if check_admission:
+                admitted, retry_after, message = self._admission(owner, PRIORITY_NORMAL)
+                if not admitted:
+                    return None, retry_after, message
+            # Registered before any task is released, so its backlog counts toward admission at once
+            self._batches[batch.id] = batch
+            while len(self._batches) > self.max_finished_jobs:
+                del self._batches[next(iter(self._batches))]  # oldest first
+        logger.info(f"Queued batch {batch.id} of {batch.size} jobs, at most {batch.max_parallel} at a time")
+        batch._release(self.submit)
+        return batch, 0, "Queued"
+
+    def get_batch(self, batch_id: str) -> Optional[RenderBatch]:
+        """Look up a batch by id"""
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def get(self, job_id: str) -> Optional[RenderJob]:
+        """Look up a job by id"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict:
+        """Counts of jobs per status"""
+        with self._lock:
+            counts = {JOB_QUEUED: 0, JOB_RENDERING: 0, JOB_DONE: 0, JOB_FAILED: 0, JOB_CANCELLED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            counts['running'] = self._running
+            counts['owners_running'] = len(self._running_by_owner)
+            counts['mean_service_seconds'] = round(self._service_seconds, 2)
+        counts['workers'] = self.workers
+        counts['max_queued'] = self.max_queued
+        counts['max_queued_per_owner'] = self.max_queued_per_owner
+        return counts
+
+    def _notify_workers(self):
+        with self._work_ready:
+            self._work_ready.notify_all()
+
+    @staticmethod
+    def _ready(job: RenderJob) -> bool:
+        return job.after is None or job.after.finished
+
+    def _worker_loop(self):
+        """Take the next job and run it until the process exits"""
+        while True:
+            with self._work_ready:
+                job = None
+                while job is None:
+                    self._work_ready.wait_for(lambda: any(self._ready(job) for job in self._pending))
+                    job = self._take_next()
+            self._run(job)
+
+    def _take_next(self) -> Optional[RenderJob]:
+        """Pick by priority, then the owner with the fewest running jobs, least recently served, then FIFO"""
+        self._pending = [job for job in self._pending if job.status == JOB_QUEUED]
+        active = {job.owner for job in self._pending} | set(self._running_by_owner)
+        self._last_served = {owner: turn for owner, turn in self._last_served.items() if owner in active}
+        ready = [job for job in self._pending if self._ready(job)]
+        if not ready:
+            return None
+        job = min(ready, key=lambda job: (job.priority, self._running_by_owner.get(job.owner, 0),
+                                                  self._last_served.get(job.owner, -1), job.sequence))
+        self._pending.remove(job)
+        self._running += 1
+        # Speculation must not cost its session fair-share position for the previews it actually asks for
+        if job.priority < PRIORITY_SPECULATIVE:
+            self._last_served[job.owner] = next(self._turns)
+            self._running_by_owner[job.owner] = self._running_by_owner.get(job.owner, 0) + 1
+            self._owner_counted.add(job.id)
+        return job
+
+    def _release_worker(self, job: RenderJob, elapsed: Optional[float] = None):
+        with self._lock:
+            self._running -= 1
+            if job.id in self._owner_counted:
+                self._owner_counted.discard(job.id)
+                self._running_by_owner[job.owner] -= 1
+                if not self._running_by_owner[job.owner]:
+                    del self._running_by_owner[job.owner]
+            if elapsed is not None:
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * elapsed
+
+    def _run(self, job: RenderJob):
+        """Execute one job and record its outcome"""
+        with job._changed:
+            cancelled = job.status == JOB_CANCELLED
+            if not cancelled:
+                job.status = JOB_RENDERING
+                job.started_at = datetime.now()
+        if cancelled:
+            self._release_worker(job)
+            return  # cancelled after it was picked
+        started = time.monotonic()
+        job.report('started')
+        logger.info(f"Job {job.id} started on {threading.current_thread().name}")
+        try:
+            job.result = job.task(job) or {}
+            job.finished_at = datetime.now()
+            job.status = JOB_DONE
+            job.report(JOB_DONE)
+            logger.info(f"Job {job.id} finished successfully")
+        except JobCancelled as e:
+            job.error = str(e)
+            job.finished_at = datetime.now()
+            job.status = JOB_CANCELLED
+            job.report(JOB_CANCELLED, reason=job.error)
+            logger.info(f"Job {job.id} stopped after cancellation: {e}")
+        except Exception as e:
+            job.error = str(e)
+            job.finished_at = datetime.now()
+            job.status = JOB_FAILED
+            job.report(JOB_FAILED, error=job.error)
+            logger.error(f"Job {job.id} failed: {e}")
+        finally:
+            self._release_worker(job, time.monotonic() - started)
+        job._run_callbacks()
+
+    def _prune_finished(self):
+        """Drop the oldest finished jobs so the registry stays bounded"""
+        finished = [job for job in self._jobs.values() if job.finished]
+        excess = len(finished) - self.max_finished_jobs
+        if excess <= 0:
+            return
+        finished.sort(key=lambda job: job.finished_at or job.created_at)
+        for job in finished[:excess]:
+            del self._jobs[job.id]
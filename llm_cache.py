@@ -0,0 +1,93 @@
+"""
+Persistent cache of LLM chat completions.
+Responses are stored in SQLite keyed on model, temperature and a hash of
+the prompt messages, with a TTL and a maximum number of entries.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlite_store import SQLiteCache
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache(SQLiteCache):
+    """SQLite-backed cache of chat completion responses"""
+
+    def __init__(self, db_path: Path, ttl_seconds: int, max_entries: int):
+        super().__init__(db_path, [
+            """
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_completions_accessed ON completions (accessed_at)",
+        ])
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        logger.info(f"LLM cache at {self.db_path.absolute()} (ttl {ttl_seconds}s, max {max_entries} entries)")
+
+    @staticmethod
+    def make_key(model: str, temperature: float, messages: List[Dict]) -> str:
+        """Hash of model, temperature and prompt messages"""
+        payload = json.dumps({'model': model, 'temperature': temperature, 'messages': messages}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None if missing or expired"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT content, created_at FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+                self._count_lookup(hit=True)
+                logger.info(f"LLM cache hit: {key[:12]}")
+                return row[0]
+            if row:
+                conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+        self._count_lookup(hit=False)
+        logger.info(f"LLM cache miss: {key[:12]}")
+        return None
+
+    def put(self, key: str, model: str, content: str):
+        """Store a response and evict expired and least recently used entries"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, content, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now)
+            )
+            conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM completions WHERE key IN ("
+                "SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def delete(self, key: str) -> bool:
+        """Drop a cached response, e.g. code that failed to render; returns whether one was stored"""
+        with self._connect() as conn:
+            deleted = conn.execute("DELETE FROM completions WHERE key = ?", (key,)).rowcount
+        if deleted:
+            logger.info(f"LLM cache invalidated: {key[:12]}")
+        return bool(deleted)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and number of stored responses"""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return {**self._lookup_stats(), 'entries': entries, 'max_entries': self.max_entries}
+
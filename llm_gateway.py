@@ -0,0 +1,233 @@
+"""
+Shared gateway for all LLM calls.
+Owns a single OpenAI-compatible client with a pooled HTTP connection, bounds
+the number of concurrent requests, retries rate limits and server errors with
+exponential backoff, consults the response cache and keeps per-call latency
+and token accounting.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import httpx
+import openai
+from openai import OpenAI
+
+from llm_cache import LLMCache
+from metrics import LLM_FIRST_TOKEN_SECONDS, LLM_REQUEST_SECONDS, LLM_REQUESTS, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+
+class LLMGateway:
+    """Pooled, rate-limited, cached access to a chat completion API"""
+
+    CHARS_PER_TOKEN = 4  # rough token estimate for streams that end without a usage chunk
+
+    def __init__(self, api_key: str, base_url: str, model: str, max_concurrency: int = 8,
+                 max_retries: int = 4, timeout: float = 600, cache: Optional[LLMCache] = None,
+                 client=None, backoff_base: float = 1.0, backoff_max: float = 60.0):
+        logger.info(f"Initializing LLM gateway for {base_url} (model {model}, "
+                    f"max {max_concurrency} concurrent requests)")
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+                timeout=timeout
+            )
+            # Retries are handled here so they respect the concurrency limit and get logged
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        self.client = client
+        self.model = model
+        self.max_retries = max_retries
+        self.cache = cache
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'cache_hits': 0,
+            'errors': 0,
+            'retries': 0,
+            'streams': 0,
+            'latency_seconds': 0.0,
+            'first_token_seconds': 0.0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+        }
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """Rate limits, server errors and connection problems are worth retrying"""
+        if isinstance(error, openai.APIConnectionError):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+        return False
+
+    def _backoff_delay(self, error: Exception, attempt: int) -> float:
+        """Seconds to wait before the next attempt, honouring Retry-After"""
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        delay = self.backoff_base * (2 ** attempt)
+        return min(delay + random.uniform(0, delay / 2), self.backoff_max)
+
+    def _record(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._stats[key] += value
+
+    def _create(self, **kwargs):
+        """Send one completion request, retrying rate limits and server errors"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if attempt < self.max_retries and self._is_retryable(e):
+                    delay = self._backoff_delay(e, attempt)
+                    logger.warning(f"LLM call failed ({e}), retry {attempt + 1}/{self.max_retries} "
+                                   f"in {delay:.1f}s")
+                    self._record(retries=1)
+                    LLM_REQUESTS.inc(outcome='retry')
+                    time.sleep(delay)
+                    continue
+                self._record(errors=1)
+                LLM_REQUESTS.inc(outcome='error')
+                raise
+
+    def chat(self, messages: List[Dict], temperature: float, model: Optional[str] = None,
+             use_cache: bool = True) -> str:
+        """Run a chat completion and return the message content"""
+        model = model or self.model
+        cache = self.cache if use_cache else None
+        key = LLMCache.make_key(model, temperature, messages) if cache else None
+        if cache:
+            content = cache.get(key)
+            if content is not None:
+                self._record(cache_hits=1)
+                LLM_REQUESTS.inc(outcome='cache_hit')
+                return content
+
+        with self._semaphore:
+            start = time.monotonic()
+            response = self._create(model=model, messages=messages, temperature=temperature)
+
+        elapsed = time.monotonic() - start
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        self._record(calls=1, latency_seconds=elapsed,
+                     prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        LLM_REQUESTS.inc(outcome='success')
+        LLM_REQUEST_SECONDS.observe(elapsed, mode='chat')
+        if usage is not None:
+            self._observe_tokens(prompt_tokens, completion_tokens)
+        logger.info(f"LLM call to {model} took {elapsed:.2f}s "
+                    f"({prompt_tokens} prompt / {completion_tokens} completion tokens)")
+
+        content = response.choices[0].message.content
+        if cache and content:
+            cache.put(key, model, content)
+        return content
+
+    def stream_chat(self, messages: List[Dict], temperature: float, model: Optional[str] = None,
+                    use_cache: bool = True, complete: Optional[Callable[[], bool]] = None) -> Iterator[str]:
+        """Yield the message content as it is generated; closing the iterator aborts the request.
+
+        Reasoning tokens are never part of the content and are not kept. A stream
+        the caller closes early is cached only if complete() then confirms that the
+        content received so far is everything it needs; otherwise the truncated
+        response would be served to the next identical request.
+        """
+        model = model or self.model
+        cache = self.cache if use_cache else None
+        key = LLMCache.make_key(model, temperature, messages) if cache else None
+        if cache:
+            content = cache.get(key)
+            if content is not None:
+                self._record(cache_hits=1)
+                LLM_REQUESTS.inc(outcome='cache_hit')
+                yield content
+                return
+
+        with self._semaphore:
+            start = time.monotonic()
+            # Ask for a final usage chunk; extra_body keeps this working on clients without stream_options
+            stream = self._create(model=model, messages=messages, temperature=temperature, stream=True,
+                                  extra_body={'stream_options': {'include_usage': True}})
+            received = []
+            first_token = None
+            usage = None
+            closed_early = False
+            try:
+                for chunk in stream:
+                    usage = getattr(chunk, 'usage', None) or usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if first_token is None:
+                        first_token = time.monotonic() - start
+                        logger.info(f"First token from {model} after {first_token:.2f}s")
+                    received.append(delta)
+                    yield delta
+            except GeneratorExit:
+                closed_early = True
+                logger.info(f"Stream from {model} closed by caller after {sum(map(len, received))} characters")
+            except Exception:
+                self._record(errors=1)
+                LLM_REQUESTS.inc(outcome='error')
+                raise
+            finally:
+                close = getattr(stream, 'close', None)
+                if close:
+                    close()
+
+        elapsed = time.monotonic() - start
+        content = "".join(received)
+        if usage is not None:
+            prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+            completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        else:
+            # Closed early, or the provider ignored include_usage
+            prompt_tokens = sum(len(message.get('content') or '') for message in messages) // self.CHARS_PER_TOKEN
+            completion_tokens = len(content) // self.CHARS_PER_TOKEN
+        self._record(calls=1, streams=1, latency_seconds=elapsed, first_token_seconds=first_token or 0.0,
+                     prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        LLM_REQUESTS.inc(outcome='success')
+        LLM_REQUEST_SECONDS.observe(elapsed, mode='stream')
+        self._observe_tokens(prompt_tokens, completion_tokens)
+        if first_token is not None:
+            LLM_FIRST_TOKEN_SECONDS.observe(first_token)
+        logger.info(f"LLM stream from {model} took {elapsed:.2f}s "
+                    f"({prompt_tokens} prompt / {completion_tokens} completion tokens"
+                    f"{'' if usage is not None else ', estimated'})")
+        if cache and content and (not closed_early or (complete is not None and complete())):
+            cache.put(key, model, content)
+
+    @staticmethod
+    def _observe_tokens(prompt_tokens: int, completion_tokens: int):
+        LLM_TOKENS.observe(prompt_tokens, type='prompt')
+        LLM_TOKENS.observe(completion_tokens, type='completion')
+
+    def invalidate(self, messages: List[Dict], temperature: float, model: Optional[str] = None) -> bool:
+        """Forget the cached response to a request so the next identical one goes to the model"""
+        if not self.cache:
+            return False
+        return self.cache.delete(LLMCache.make_key(model or self.model, temperature, messages))
+
+    def stats(self) -> Dict:
+        """Call, retry, error, latency and token totals"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mean_latency_seconds'] = stats['latency_seconds'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
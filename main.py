@@ -9,19 +9,38 @@ import json
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Iterator, Optional, Tuple
 import tempfile
 import subprocess
 import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, render_template, request, jsonify, send_file, session
+from flask import Flask, Response, g, render_template, request, jsonify, session
 from werkzeug.utils import secure_filename
 import PyPDF2
 import fitz  # PyMuPDF for better text extraction
-import openai
-from openai import OpenAI
 import re
 
+from jobs import RenderJobQueue, JobCancelled, JOB_QUEUED, JOB_RENDERING, JOB_DONE, JOB_FAILED, JOB_CANCELLED, PRIORITY_FINAL
+from speculation import Speculator
+from render_cache import RenderCache, link_or_copy
+from tex_cache import TexCache
+from workspace import WorkspaceManager
+from video_index import VideoIndex
+from video_postprocess import VideoPostProcessor
+from llm_cache import LLMCache
+from llm_gateway import LLMGateway
+from pdf_cache import PDFTextCache
+from pdf_extract import PageExtractionPool
+from session_store import SessionStore
+import metrics
+from scene_code import CodeFenceExtractor, validate_scene_code
+from render_server import CANCEL_POLL_SECONDS, WarmRenderPool, RenderWorkerError
+
 # Configure enhanced logging
 logging.basicConfig(
     level=logging.INFO,
@@ -33,62 +52,162 @@ class Config:
     """Application configuration"""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
     UPLOAD_FOLDER = 'uploads'
-    VIDEO_FOLDER = './'
+    VIDEO_FOLDER = 'videos/output'  # finished MP4s, served by /videos/<filename>
+    WORKSPACE_FOLDER = 'videos/work'  # per-render scratch space, deleted after each render
+    SOURCE_FOLDER = 'videos/scene_source'  # kept scene sources; code/ holds known-good scenes for benchmark.py
+    KEEP_SCENE_SOURCE = os.environ.get('KEEP_SCENE_SOURCE', '0') == '1'  # keep each rendered scene's .py
+    VIDEO_MAX_AGE = int(os.environ.get('VIDEO_MAX_AGE_HOURS', 72)) * 3600  # 0 keeps videos forever
+    VIDEO_QUOTA_BYTES = int(os.environ.get('VIDEO_QUOTA_MB', 5120)) * 1024 * 1024  # 0 for no quota
+    DISK_GC_INTERVAL = int(os.environ.get('DISK_GC_INTERVAL', 600))  # seconds
+    VIDEO_OFFLOAD = os.environ.get('VIDEO_OFFLOAD', '')  # '', 'x-accel' (nginx) or 'x-sendfile'
+    VIDEO_ACCEL_PREFIX = os.environ.get('VIDEO_ACCEL_PREFIX', '/internal/videos/')  # nginx internal location
+    VIDEO_CACHE_MAX_AGE = 86400  # seconds browsers may reuse a video; names are never reused
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'pdf'}
     OPENAI_API_KEY = "YOUR_API_KEY" 
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://openrouter.ai/api/v1')
+    LLM_MODEL = os.environ.get('LLM_MODEL', 'deepseek/deepseek-r1-0528:free')
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))  # in-flight requests, also the connection pool size
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 4))  # retries on 429/5xx with exponential backoff
+    LLM_TIMEOUT = int(os.environ.get('LLM_TIMEOUT', 600))  # seconds per request
     MANIM_QUALITY = 'high'  # high, medium, low
+    PDF_TEXT_BUDGET = int(os.environ.get('PDF_TEXT_BUDGET', 0))  # characters to extract, 0 for all
+    PDF_EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+    ANALYSIS_CONCURRENCY = int(os.environ.get('ANALYSIS_CONCURRENCY', 4))  # parallel chunk prompts
+    ANALYSIS_MAX_CHUNKS = int(os.environ.get('ANALYSIS_MAX_CHUNKS', 16))
+    RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))  # concurrent renders
+    BATCH_MAX_PARALLEL = int(os.environ.get('BATCH_MAX_PARALLEL', max(1, RENDER_WORKERS // 2)))  # per batch, leaves workers for others
+    MAX_QUEUED_JOBS = int(os.environ.get('MAX_QUEUED_JOBS', RENDER_WORKERS * 4))  # waiting renders before 429, 0 for no limit
+    MAX_QUEUED_PER_SESSION = int(os.environ.get('MAX_QUEUED_PER_SESSION', 3))  # waiting renders per browser session
+    RENDER_TIMEOUT = int(os.environ.get('RENDER_TIMEOUT', 300))  # seconds per Manim attempt
+    MAX_REPAIR_ATTEMPTS = int(os.environ.get('MAX_REPAIR_ATTEMPTS', 2))  # LLM fixes after a failed render
+    SEGMENT_RENDERING = os.environ.get('SEGMENT_RENDERING', '0') == '1'  # split long scenes across workers
+    SEGMENT_MIN_ANIMATIONS = int(os.environ.get('SEGMENT_MIN_ANIMATIONS', 4))  # animations per segment
+    SEGMENT_PROCESSES = int(os.environ.get('SEGMENT_PROCESSES', os.cpu_count() or 1))  # segment Manim processes across all jobs
+    VIDEO_FASTSTART = os.environ.get('VIDEO_FASTSTART', '1') == '1'  # move the moov atom to the front
+    WEB_PROFILE = os.environ.get('WEB_PROFILE', '')  # e.g. 720p30 to transcode larger renders, '' keeps Manim's
+    WEB_PROFILE_CRF = int(os.environ.get('WEB_PROFILE_CRF', 23))  # x264 quality target for the web profile
+    SSE_KEEPALIVE_SECONDS = 15  # comment frames keep idle progress streams open through proxies
+    RENDER_SERVER_ENABLED = os.environ.get('RENDER_SERVER_ENABLED', '1') == '1'  # warm Manim workers
+    RENDER_SERVER_MAX_JOBS = int(os.environ.get('RENDER_SERVER_MAX_JOBS', 20))  # jobs before a worker is recycled
+    PROGRESSIVE_RENDERING = os.environ.get('PROGRESSIVE_RENDERING', '1') == '1'  # preview first, upgrade later
+    PREVIEW_QUALITIES = ['-ql']
+    SPECULATIVE_GENERATION = os.environ.get('SPECULATIVE_GENERATION', '0') == '1'  # pre-generate likely picks
+    SPECULATIVE_TOP_K = int(os.environ.get('SPECULATIVE_TOP_K', 3))  # top-ranked concepts per upload
+    SPECULATIVE_PREVIEW = os.environ.get('SPECULATIVE_PREVIEW', '0') == '1'  # also render their previews
+    FINAL_QUALITIES = ['-qh', '-qm']
+    RENDER_CACHE_FOLDER = 'videos/render_cache'
+    RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_MB', 2048)) * 1024 * 1024
+    TEX_CACHE_FOLDER = 'cache/tex'
+    TEX_CACHE_MAX_BYTES = int(os.environ.get('TEX_CACHE_MAX_MB', 256)) * 1024 * 1024
+    LLM_CACHE_PATH = 'cache/llm_cache.sqlite3'
+    PDF_CACHE_PATH = 'cache/pdf_cache.sqlite3'
+    PDF_CACHE_MAX_ENTRIES = int(os.environ.get('PDF_CACHE_MAX_ENTRIES', 500))
+    SESSION_DB_PATH = 'cache/sessions.sqlite3'  # PDF text, concepts and current video per browser session
+    SESSION_TTL = int(os.environ.get('SESSION_TTL_HOURS', 24)) * 3600  # idle seconds before a session is dropped
+    LLM_CACHE_TTL = int(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))  # seconds
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 5000))
 
 class PDFProcessor:
     """Handles PDF processing and content extraction"""
     
+    PARALLEL_MIN_PAGES = 40  # smaller documents are not worth a process pool
+    
+    def __init__(self, extraction_pool: Optional[PageExtractionPool] = None):
+        self.extraction_pool = extraction_pool
+    
     @staticmethod
-    def extract_text_from_pdf(file_path: str) -> str:
-        """Extract text from PDF using PyMuPDF for better quality"""
+    def iter_pages(file_path: str) -> Iterator[str]:
+        """Lazily yield the text of each page using PyMuPDF for better quality"""
         logger.info(f"Starting PDF text extraction from: {file_path}")
+        pages_done = 0
         try:
-            doc = fitz.open(file_path)
-            text = ""
-            for page_num, page in enumerate(doc):
-                page_text = page.get_text()
-                text += page_text
-                logger.debug(f"Extracted {len(page_text)} characters from page {page_num + 1}")
-            doc.close()
-            logger.info(f"Successfully extracted {len(text)} characters from PDF")
-            return text
+            with fitz.open(file_path) as doc:
+                for page in doc:
+                    page_text = page.get_text()
+                    logger.debug(f"Extracted {len(page_text)} characters from page {pages_done + 1}")
+                    pages_done += 1
+                    yield page_text
         except Exception as e:
             logger.error(f"Error extracting text from PDF with PyMuPDF: {e}")
             logger.info("Falling back to PyPDF2")
-            # Fallback to PyPDF2
-            return PDFProcessor._extract_with_pypdf2(file_path)
+            # Fallback to PyPDF2 for the pages PyMuPDF did not deliver
+            yield from PDFProcessor._iter_pages_pypdf2(file_path, start_page=pages_done)
     
     @staticmethod
-    def _extract_with_pypdf2(file_path: str) -> str:
+    def _iter_pages_pypdf2(file_path: str, start_page: int = 0) -> Iterator[str]:
         """Fallback PDF extraction method"""
         logger.info(f"Using PyPDF2 fallback for: {file_path}")
         try:
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    text += page_text
+                for page_num in range(start_page, len(pdf_reader.pages)):
+                    page_text = pdf_reader.pages[page_num].extract_text()
                     logger.debug(f"PyPDF2: Extracted {len(page_text)} characters from page {page_num + 1}")
-                logger.info(f"PyPDF2: Successfully extracted {len(text)} characters")
-                return text
+                    yield page_text
         except Exception as e:
             logger.error(f"Error with PyPDF2 extraction: {e}")
-            return ""
+    
+    @staticmethod
+    def extract_pages(file_path: str, max_chars: Optional[int] = None) -> List[str]:
+        """Extract pages in order, stopping once max_chars characters are collected"""
+        pages = []
+        total_chars = 0
+        for page_text in PDFProcessor.iter_pages(file_path):
+            pages.append(page_text)
+            total_chars += len(page_text)
+            if max_chars and total_chars >= max_chars:
+                logger.info(f"Reached text budget of {max_chars} characters after {len(pages)} pages")
+                break
+        logger.info(f"Successfully extracted {total_chars} characters from PDF")
+        return pages
+    
+    @staticmethod
+    def extract_text_from_pdf(file_path: str, max_chars: Optional[int] = None) -> str:
+        """Extract text page by page, stopping once max_chars characters are collected"""
+        text = "".join(PDFProcessor.extract_pages(file_path, max_chars))
+        return text[:max_chars] if max_chars else text
+    
+    def extract_pages_parallel(self, file_path: str) -> List[str]:
+        """Extract all pages, splitting large documents into page ranges across the extraction pool"""
+        pool = self.extraction_pool
+        if not pool or not pool.available():
+            return list(PDFProcessor.iter_pages(file_path))
+        try:
+            with fitz.open(file_path) as doc:
+                page_count = doc.page_count
+        except Exception as e:
+            logger.error(f"Could not open PDF with PyMuPDF: {e}")
+            return list(PDFProcessor.iter_pages(file_path))
+        
+        if page_count < PDFProcessor.PARALLEL_MIN_PAGES:
+            return list(PDFProcessor.iter_pages(file_path))
+        
+        pages_per_range = -(-page_count // pool.workers)
+        ranges = [(start, min(start + pages_per_range, page_count))
+                  for start in range(0, page_count, pages_per_range)]
+        logger.info(f"Extracting {page_count} pages in {len(ranges)} parallel ranges")
+        try:
+            pages = pool.extract(file_path, ranges)
+            logger.info(f"Successfully extracted {sum(len(p) for p in pages)} characters from PDF")
+            return pages
+        except Exception as e:
+            logger.error(f"Parallel extraction failed, extracting sequentially: {e}")
+            return list(PDFProcessor.iter_pages(file_path))
 
 class ContentAnalyzer:
     """Analyzes PDF content and identifies video-worthy mathematical concepts"""
     
-    def __init__(self, api_key: str):
+    ANALYSIS_VERSION = 2  # bump when the analysis changes to invalidate cached concepts
+    CHUNK_SIZE = 4000  # characters per analysis prompt
+    CHUNK_OVERLAP = 400  # characters shared by neighbouring chunks
+    MAX_CONCEPTS = 10
+    
+    def __init__(self, llm: LLMGateway, concurrency: int = 4, max_chunks: int = 16):
         logger.info("Initializing ContentAnalyzer")
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url="https://openrouter.ai/api/v1"
-        )
+        self.llm = llm
+        self.concurrency = max(1, concurrency)
+        self.max_chunks = max(1, max_chunks)
         logger.info("ContentAnalyzer initialized successfully")
         
     
@@ -120,8 +239,7 @@ class ContentAnalyzer:
             """ + text[:4000]  # Limit text length for API
             
             logger.info("Sending content analysis request to OpenAI")
-            response = self.client.chat.completions.create(
-                model="deepseek/deepseek-r1-0528:free",
+            content = self.llm.chat(
                 messages=[
                     {"role": "system", "content": "You are an expert mathematics educator who identifies content suitable for educational videos."},
                     {"role": "user", "content": prompt}
@@ -129,7 +247,6 @@ class ContentAnalyzer:
                 temperature=0.3
             )
             
-            content = response.choices[0].message.content
             logger.info(f"Received response from OpenAI: {len(content)} characters")
             logger.debug(f"OpenAI response preview: {content[:200]}...")
             
@@ -149,15 +266,93 @@ class ContentAnalyzer:
             logger.error(f"Error analyzing content: {e}")
             return []
 
+    def split_into_chunks(self, text: str) -> List[str]:
+        """Split text into overlapping chunks, sampling evenly if there are too many"""
+        step = self.CHUNK_SIZE - self.CHUNK_OVERLAP
+        chunks = [text[start:start + self.CHUNK_SIZE]
+                  for start in range(0, max(len(text) - self.CHUNK_OVERLAP, 1), step)]
+        if len(chunks) > self.max_chunks:
+            # Spread the prompt budget across the whole document
+            stride = len(chunks) / self.max_chunks
+            chunks = [chunks[int(i * stride)] for i in range(self.max_chunks)]
+        return chunks
+    
+    def analyze_document(self, text: str) -> List[Dict]:
+        """Analyze the whole document in chunks concurrently and merge the concepts"""
+        chunks = self.split_into_chunks(text)
+        if len(chunks) == 1:
+            return self.analyze_content(chunks[0])
+        
+        logger.info(f"Analyzing {len(text)} characters in {len(chunks)} chunks "
+                    f"with {min(self.concurrency, len(chunks))} concurrent requests")
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(chunks))) as pool:
+            chunk_concepts = list(pool.map(self.analyze_content, chunks))
+        
+        return self.merge_concepts(chunk_concepts)
+    
+    @classmethod
+    def merge_concepts(cls, chunk_concepts: List[List[Dict]]) -> List[Dict]:
+        """Deduplicate concepts by title and rank them by how many chunks found them"""
+        merged: Dict[str, Dict] = {}
+        mentions: Dict[str, int] = {}
+        for concepts in chunk_concepts:
+            for concept in concepts:
+                if not isinstance(concept, dict) or not concept.get('title'):
+                    continue
+                key = " ".join(re.sub(r'[^a-z0-9]+', ' ', concept['title'].lower()).split())
+                if key in merged:
+                    # Keep the first description, but collect every related key concept
+                    existing = merged[key]
+                    key_concepts = list(existing.get('key_concepts', []))
+                    for item in concept.get('key_concepts', []):
+                        if item not in key_concepts:
+                            key_concepts.append(item)
+                    existing['key_concepts'] = key_concepts
+                    mentions[key] += 1
+                else:
+                    merged[key] = dict(concept)
+                    mentions[key] = 1
+        
+        # Stable sort keeps document order among equally frequent concepts
+        ranked = sorted(merged, key=lambda key: mentions[key], reverse=True)
+        concepts = [merged[key] for key in ranked[:cls.MAX_CONCEPTS]]
+        logger.info(f"Merged {sum(len(c) for c in chunk_concepts)} chunk concepts into {len(concepts)}")
+        return concepts
+
 class ManimVideoGenerator:
     """Generates Manim videos based on mathematical content"""
     
-    def __init__(self, api_key: str):
+    QUALITY_LADDER = ['-qh', '-qm', '-ql']  # high, medium, low
+    QUALITY_DIRS = {'-ql': '480p15', '-qm': '720p30', '-qh': '1080p60', '-qp': '1440p60', '-qk': '2160p60'}
+    REPAIR_ERROR_CHARS = 3000  # tail of the failure output sent back for a repair
+    CODE_TEMPERATURE = 0.2
+    MAX_CODE_PROMPTS = 256  # recent generated code -> prompt, to invalidate cached code that never rendered
+    ANIMATION_PATTERN = re.compile(r'Animation (\d+)')  # progress bars and partial movie log lines
+    
+    def __init__(self, llm: LLMGateway, render_cache: Optional[RenderCache] = None,
+                 tex_cache: Optional[TexCache] = None, render_pool: Optional[WarmRenderPool] = None, render_timeout: int = 300,
+                 max_repair_attempts: int = 2, segment_workers: int = 0, segment_min_animations: int = 4,
+                 segment_processes: int = os.cpu_count() or 1, video_folder: Path = Path("videos/output"), workspaces: Optional[WorkspaceManager] = None,
+                 source_folder: Optional[Path] = None, postprocessor: Optional[VideoPostProcessor] = None):
         logger.info("Initializing ManimVideoGenerator")
-        self.client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=api_key)
-        self.video_folder = Path("videos")
-        self.video_folder.mkdir(exist_ok=True)
+        self.llm = llm
+        self.max_repair_attempts = max(0, max_repair_attempts)
+        self.segment_workers = segment_workers  # 0 renders every scene whole
+        self.segment_min_animations = max(2, segment_min_animations)
+        # Shared by all jobs, so concurrent segmented renders cannot start workers x segments Manim processes
+        self._segment_slots = threading.BoundedSemaphore(max(1, segment_processes))
+        self.video_folder = Path(video_folder)
+        self.video_folder.mkdir(parents=True, exist_ok=True)
         logger.info(f"Video folder created/verified: {self.video_folder.absolute()}")
+        self.workspaces = workspaces or WorkspaceManager(self.video_folder.parent / "work", self.video_folder)
+        self.source_folder = Path(source_folder) if source_folder else None
+        self.render_cache = render_cache
+        self.tex_cache = tex_cache
+        self.render_pool = render_pool
+        self.render_timeout = render_timeout
+        self.postprocessor = postprocessor
+        self._code_prompts: Dict[str, List[Dict]] = {}
+        self._code_prompts_lock = threading.Lock()
         
         # Check if Manim is available
         self.manim_available = self.check_manim_available()
@@ -167,6 +362,11 @@ class ManimVideoGenerator:
         """Check if Manim is available"""
         logger.info("Checking Manim availability...")
         
+        # Warm workers have already imported Manim, no need for a probe process
+        if self.render_pool and self.render_pool.available():
+            logger.info(f"Manim found in warm render workers! Version: {self.render_pool.version}")
+            return True
+        
         # Try different ways to invoke Manim
         commands_to_try = [
             ['python', '-m', 'manim', '--version'],
@@ -193,7 +393,8 @@ class ManimVideoGenerator:
         logger.error("Manim not found in any expected location")
         return False
     
-    def generate_manim_code(self, concept: Dict, context: str) -> str:
+    def generate_manim_code(self, concept: Dict, context: str,
+                            check_cancelled: Optional[Callable[[], None]] = None) -> str:
         """Generate Manim code for a mathematical concept"""
         logger.info(f"Generating Manim code for concept: {concept.get('title', 'Unknown')}")
         logger.debug(f"Concept details: {concept}")
@@ -222,28 +423,149 @@ class ManimVideoGenerator:
         """
         
         try:
-            logger.info("Sending Manim code generation request to OpenAI")
-            response = self.client.chat.completions.create(
-                model="deepseek/deepseek-r1-0528:free",
-                messages=[
-                    {"role": "system", "content": "You are an expert in creating educational Manim animations. Generate clean, well-commented code."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2
-            )
-            
-            manim_code = response.choices[0].message.content
+            logger.info("Streaming Manim code generation request")
+            manim_code = self._stream_code([
+                {"role": "system", "content": "You are an expert in creating educational Manim animations. Generate clean, well-commented code."},
+                {"role": "user", "content": prompt}
+            ], check_cancelled)
+            if not manim_code:
+                logger.error("No code block found in the generated response")
+                return ""
             logger.info(f"Generated Manim code: {len(manim_code)} characters")
             logger.debug(f"Manim code preview: {manim_code[:200]}...")
             return manim_code
             
+        except JobCancelled:
+            raise
         except Exception as e:
             logger.error(f"Error generating Manim code: {e}")
             return ""
     
-    def create_video(self, concept: Dict, context: str) -> Tuple[bool, str, str]:
-        """Create video from concept and return success status, video path, and logs"""
-        logger.info(f"Starting video creation for concept: {concept.get('title', 'Unknown')}")
+    def repair_manim_code(self, manim_code: str, error: str,
+                          check_cancelled: Optional[Callable[[], None]] = None) -> str:
+        """Ask the LLM to fix Manim code given the error from a failed render"""
+        logger.info(f"Requesting a repair for {len(manim_code)} characters of failing code")
+        prompt = f"""
+        The following Manim scene failed to render.
+        
+        Code:
+        ```python
+        {manim_code}
+        ```
+        
+        Error (most recent output last):
+        {error[-self.REPAIR_ERROR_CHARS:]}
+        
+        Fix the error while keeping the scene's content and animations the same.
+        Return only the complete corrected Python code for the Manim scene.
+        """
+        
+        try:
+            repaired = self._stream_code([
+                {"role": "system", "content": "You are an expert in creating educational Manim animations. Generate clean, well-commented code."},
+                {"role": "user", "content": prompt}
+            ], check_cancelled)
+            if not repaired:
+                logger.error("No code block found in the repair response")
+                return ""
+            logger.info(f"Repaired Manim code: {len(repaired)} characters")
+            return repaired
+            
+        except JobCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Error repairing Manim code: {e}")
+            return ""
+
+    def _stream_code(self, messages: List[Dict], check_cancelled: Optional[Callable[[], None]] = None) -> str:
+        """Stream a code generation request, stopping as soon as the code block closes or the job is cancelled"""
+        extractor = CodeFenceExtractor()
+        # Closed early, the response is only worth caching once the code block has closed
+        stream = self.llm.stream_chat(messages=messages, temperature=self.CODE_TEMPERATURE,
+                                      complete=lambda: extractor.done)
+        try:
+            for delta in stream:
+                if check_cancelled:
+                    check_cancelled()  # closing the stream below aborts the request
+                if extractor.feed(delta) is not None:
+                    logger.info("Code block complete, closing the stream early")
+                    break
+        finally:
+            stream.close()
+        code = extractor.finish() or ""
+        if code:
+            with self._code_prompts_lock:
+                self._code_prompts.pop(code, None)
+                self._code_prompts[code] = messages
+                while len(self._code_prompts) > self.MAX_CODE_PROMPTS:
+                    del self._code_prompts[next(iter(self._code_prompts))]
+        return code
+
+    def _invalidate_code(self, codes: List[str]):
+        """Drop the cached LLM responses that produced code which never rendered"""
+        for code in codes:
+            with self._code_prompts_lock:
+                messages = self._code_prompts.pop(code, None)
+            if messages and self.llm.invalidate(messages, self.CODE_TEMPERATURE):
+                logger.info(f"Invalidated cached LLM response for {len(code)} characters of failing code")
+
+    def prepare_scene_code(self, concept: Dict, context: str,
+                           check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[bool, str, str]:
+        """Generate Manim code, returning success status, code, and logs"""
+        # Markdown fences are stripped while the response streams in
+        logger.info("Generating Manim code")
+        manim_code = self.generate_manim_code(concept, context, check_cancelled)
+        if not manim_code:
+            error_msg = "Failed to generate Manim code"
+            logger.error(error_msg)
+            return False, "", error_msg
+
+        return True, manim_code, "Manim code generated"
+
+    def render_with_repairs(self, manim_code: str, qualities: Optional[List[str]] = None,
+                            on_progress: Optional[Callable[..., None]] = None,
+                            check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[bool, str, str, str]:
+        """Render code, feeding each failure back to the LLM for a fix; also returns the code that rendered.
+
+        check_cancelled is called before and during each render and during repairs, and stops the work by raising.
+        """
+        report = on_progress or (lambda stage, **details: None)
+        check_cancelled = check_cancelled or (lambda: None)
+        attempted = [manim_code]
+        for attempt in range(self.max_repair_attempts + 1):
+            check_cancelled()
+            success, video_path, message = self.render_scene(manim_code, qualities, on_progress, check_cancelled)
+            if success or not self.manim_available or attempt == self.max_repair_attempts:
+                break
+
+            logger.warning(f"Render attempt {attempt + 1} failed, requesting a repair: {message[-200:]}")
+            report('repairing', attempt=attempt + 1, error=message[-self.REPAIR_ERROR_CHARS:])
+            metrics.REPAIR_ATTEMPTS.inc()
+            repaired = self.repair_manim_code(manim_code, message, check_cancelled)
+            if not repaired or repaired == manim_code:
+                logger.warning("Repair produced no new code, giving up")
+                break
+            manim_code = repaired
+            attempted.append(manim_code)
+
+        if success and attempt:
+            logger.info(f"Scene rendered after {attempt} repair(s)")
+        elif not success and self.manim_available:
+            # Otherwise a retry of the same concept replays the same broken code until the TTL expires
+            self._invalidate_code(attempted)
+        return success, video_path, message, manim_code
+
+    def render_scene(self, manim_code: str, qualities: Optional[List[str]] = None,
+                     on_progress: Optional[Callable[..., None]] = None,
+                     check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[bool, str, str]:
+        """Render prepared Manim code, trying each quality flag in order.
+
+        check_cancelled is polled while Manim runs; when it raises, the render is
+        killed and the exception propagates.
+        """
+        qualities = qualities or self.QUALITY_LADDER
+        logger.info(f"Rendering scene with quality ladder: {qualities}")
+        report = on_progress or (lambda stage, **details: None)
 
         try:
             # Check if Manim is available first
@@ -252,203 +574,393 @@ class ManimVideoGenerator:
                 logger.error(error_msg)
                 return False, "", error_msg
 
-            # Generate Manim code
-            logger.info("Step 1: Generating Manim code")
-            manim_code = self.generate_manim_code(concept, context)
-            if not manim_code:
-                error_msg = "Failed to generate Manim code"
-                logger.error(error_msg)
-                return False, "", error_msg
+            # Validate before paying for any Manim process startup
+            report('validating')
+            with metrics.VALIDATION_SECONDS.time():
+                valid, scene, message = validate_scene_code(manim_code)
+            if not valid:
+                metrics.RENDER_RESULTS.inc(outcome='invalid')
+                return False, "", f"Generated code failed validation: {message}"
+            manim_code = scene.code
+            scene_class = scene.scene_name
 
-            logger.info("Step 2: Processing generated code")
-            # Clean up code (remove markdown formatting if present)
-            original_code_length = len(manim_code)
-            if "```python" in manim_code:
-                manim_code = manim_code.split("```python")[1].split("```")[0]
-                logger.info("Removed python markdown formatting")
-            elif "```" in manim_code:
-                manim_code = manim_code.split("```")[1].split("```")[0]
-                logger.info("Removed generic markdown formatting")
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            scene_name = f"MathScene_{timestamp}_{uuid.uuid4().hex[:6]}"
+            logger.info(f"Scene name: {scene_name}, scene class: {scene_class}")
+
+            # Identical scenes are served straight from the render cache, but only at the quality asked
+            # for: the lower rungs of the ladder are fallbacks, not substitutes for a final video
+            final_path = (self.video_folder / f"{scene_name}.mp4").resolve()
+            cached_video = self.render_cache.get(manim_code, scene_class, qualities[0]) if self.render_cache else None
+            if cached_video:
+                try:
+                    with metrics.VIDEO_STORE_SECONDS.time(source='render_cache'):
+                        link_or_copy(cached_video, final_path)
+                    metrics.RENDER_RESULTS.inc(outcome='cached')
+                    logger.info(f"Served video from render cache: {final_path}")
+                    return True, str(final_path), "Video served from cache"
+                except FileNotFoundError:
+                    logger.info(f"Cached video {cached_video.name} was evicted before use, rendering it")
 
-            logger.info(f"Code length after cleanup: {len(manim_code)} (was {original_code_length})")
+            # Source, media, partial movies and Tex output all live in a scratch workspace
+            with self.workspaces.workspace(scene_name) as workspace:
+                temp_path = (workspace / f"{scene_name}.py").resolve()
+                temp_path.write_text(manim_code, encoding='utf-8')
+                logger.info(f"Wrote {len(manim_code)} characters to {temp_path}")
 
-            # Create temporary file for Manim code
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            scene_name = f"MathScene_{timestamp}"
-            temp_file = f"temp_{scene_name}.py"
-            temp_path = Path(temp_file).resolve()
+                # Each render gets its own media directory so output paths are known up front
+                output_dir = temp_path.parent / "media"
+                logger.info("Running Manim to generate video")
+
+                def render_progress(quality: str) -> Callable[..., None]:
+                    """Tag progress updates with the quality and the expected animation count"""
+                    return lambda stage, **details: report(stage, quality=quality, animations=scene.animations,
+                                                           **details)
+
+                rendered = None
+                segments = self.segment_ranges(scene.animations)
+                if segments:
+                    rendered = self._render_segmented(manim_code, scene_class, qualities[0], temp_path, output_dir,
+                                                      segments, render_progress(qualities[0]), check_cancelled)
+                    if not rendered[0]:
+                        logger.warning(f"Segmented render failed, rendering the scene whole: {rendered[2][-500:]}")
+                        metrics.RENDER_FALLBACKS.inc(reason='segments_failed')
+                        rendered = None
+                if rendered is None:
+                    with self._shared_tex(output_dir):
+                        if self.render_pool and self.render_pool.available():
+                            try:
+                                rendered = self._render_in_warm_worker(manim_code, scene_class, qualities[0],
+                                                                       temp_path, output_dir, render_progress,
+                                                                       check_cancelled)
+                            except RenderWorkerError as e:
+                                logger.warning(f"Warm render worker failed, falling back to a Manim subprocess: {e}")
+                                metrics.RENDER_FALLBACKS.inc(reason='warm_worker_error')
+                        if rendered is None:
+                            rendered = self._render_in_subprocess(scene_class, qualities, str(temp_path),
+                                                                  output_dir, render_progress, check_cancelled)
+                target_video, quality, error_msg = rendered
+
+                if not target_video:
+                    logger.error(error_msg)
+                    metrics.RENDER_RESULTS.inc(outcome='failed')
+                    return False, "", error_msg
+                if target_video.stat().st_size == 0:
+                    error_msg = f"Rendered video is empty: {target_video}"
+                    logger.error(error_msg)
+                    metrics.RENDER_RESULTS.inc(outcome='failed')
+                    return False, "", error_msg
+
+                if self.postprocessor and self.postprocessor.enabled:
+                    report('encoding', quality=quality)
+                    processed, target_video, message = self.postprocessor.process(target_video,
+                                                                                  self.QUALITY_DIRS[quality])
+                    if not processed:
+                        logger.warning(f"Serving the video as rendered: {message[-500:]}")
+                        metrics.RENDER_FALLBACKS.inc(reason='postprocess_failed')
+
+                # Keep only the final MP4 (and optionally the source); the workspace is deleted on exit
+                with metrics.VIDEO_STORE_SECONDS.time(source='render'):
+                    shutil.move(str(target_video), str(final_path))
+                if self.source_folder:
+                    self.source_folder.mkdir(parents=True, exist_ok=True)
+                    shutil.move(str(temp_path), str(self.source_folder / temp_path.name))
+
+            logger.info(f"Video generation completed successfully: {final_path} "
+                        f"({final_path.stat().st_size} bytes)")
+            if self.render_cache:
+                self.render_cache.put(manim_code, scene_class, quality, final_path)
+            metrics.RENDER_RESULTS.inc(outcome='success')
+            return True, str(final_path), "Video generated successfully"
+
+        except JobCancelled:
+            metrics.RENDER_RESULTS.inc(outcome='cancelled')
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error rendering video: {e}", exc_info=True)
+            metrics.RENDER_RESULTS.inc(outcome='error')
+            return False, "", str(e)
+
+    @classmethod
+    def expected_video_path(cls, media_dir: Path, module_name: str, scene_class: str, quality: str) -> Path:
+        """Where Manim writes a scene's movie: {media_dir}/videos/{module}/{resolution}/{scene}.mp4"""
+        return media_dir / "videos" / module_name / cls.QUALITY_DIRS[quality] / f"{scene_class}.mp4"
+
+    @contextmanager
+    def _shared_tex(self, media_dir: Path) -> Iterator[None]:
+        """Publish what a render compiles to the shared TeX cache; warm workers read from it as they go"""
+        tex_dir = media_dir / "Tex"  # Manim's default tex_dir under --media_dir
+        try:
+            yield
+        finally:
+            if self.tex_cache:
+                self.tex_cache.collect(tex_dir)
 
-            logger.info(f"Step 3: Creating temporary file: {temp_file}")
-            logger.info(f"Scene name: {scene_name}")
+    def segment_ranges(self, animations: Optional[int]) -> List[Tuple[int, int]]:
+        """Inclusive animation index ranges to render in parallel, or none to render the scene whole"""
+        if not self.segment_workers or not animations or not shutil.which("ffmpeg"):
+            return []
+        count = min(self.segment_workers, animations // self.segment_min_animations)
+        if count < 2:
+            return []
+        bounds = [round(i * animations / count) for i in range(count + 1)]
+        return [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
 
-            # Ensure the code has proper imports and scene class
-            if "from manim import *" not in manim_code:
-                manim_code = "from manim import *\n\n" + manim_code
-                logger.info("Added manim import statement")
+    def _render_segmented(self, manim_code: str, scene_class: str, quality: str, temp_path: Path,
+                          output_dir: Path, segments: List[Tuple[int, int]],
+                          on_progress: Callable[..., None],
+                          check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[Optional[Path], str, str]:
+        """Render animation ranges in parallel and join them; returns video path, quality flag, and error"""
+        logger.info(f"Rendering {scene_class} {quality} as {len(segments)} parallel segments: {segments}")
+        lock = threading.Lock()
+        started = set()
 
-            # Write code to file
+        def segment_progress(start: int, end: int) -> Callable[..., None]:
+            """Count animations started across all segments, ignoring the skipped ones"""
+            def report(stage: str, animation: Optional[int] = None, **details):
+                if stage == 'rendering' and animation and start < animation <= end + 1:
+                    with lock:
+                        started.add(animation)
+                        count = len(started)
+                    on_progress('rendering', animation=count, segments=len(segments))
+            return report
+
+        def render_segment(index: int) -> Tuple[Optional[Path], str]:
+            start, end = segments[index]
+            media_dir = output_dir / f"segment_{index}"
             try:
-                with open(temp_file, 'w', encoding='utf-8') as f:
-                    f.write(manim_code)
-                logger.info(f"Successfully wrote {len(manim_code)} characters to {temp_file}")
+                if self.render_pool and self.render_pool.available():
+                    with self._shared_tex(media_dir):
+                        success, video_path, message = self.render_pool.render(
+                            manim_code, scene_class, quality, temp_path, media_dir,
+                            segment_progress(start, end), animations=(start, end), check_cancelled=check_cancelled
+                        )
+                    return (Path(video_path) if success else None), message
+
+                cmd = ["python", "-m", "manim", quality, "-n", f"{start},{end}",
+                       "--media_dir", str(media_dir), str(temp_path), scene_class]
+                while not self._segment_slots.acquire(timeout=CANCEL_POLL_SECONDS):
+                    if check_cancelled:
+                        check_cancelled()
+                try:
+                    with self._shared_tex(media_dir):
+                        result = self._run_manim(cmd, segment_progress(start, end), check_cancelled)
+                finally:
+                    self._segment_slots.release()
+                video_path = self.expected_video_path(media_dir, temp_path.stem, scene_class, quality)
+                if result.returncode == 0 and video_path.exists():
+                    return video_path, "Segment rendered"
+                return None, result.stderr
+            except JobCancelled:
+                raise  # the other segments stop at their own check
             except Exception as e:
-                logger.error(f"Failed to write temporary file: {e}")
-                return False, "", f"Failed to write temporary file: {e}"
+                return None, str(e)
 
-            # Verify file was created
-            if not os.path.exists(temp_file):
-                error_msg = f"Temporary file {temp_file} was not created"
-                logger.error(error_msg)
-                return False, "", error_msg
+        def timed_segment(index: int) -> Tuple[Optional[Path], str]:
+            with metrics.RENDER_SECONDS.time(mode='segment', quality=quality):
+                video_path, message = render_segment(index)
+            metrics.RENDER_ATTEMPTS.inc(mode='segment', quality=quality,
+                                        outcome='success' if video_path else 'failed')
+            return video_path, message
 
-            logger.info(f"Temporary file size: {os.path.getsize(temp_file)} bytes")
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix="segment") as executor:
+            results = list(executor.map(timed_segment, range(len(segments))))
 
-            # Run Manim to generate video
-            logger.info("Step 4: Running Manim to generate video")
+        errors = [message for video_path, message in results if video_path is None]
+        if errors:
+            return None, "", f"Segment render failed: {errors[0]}"
 
-            # Set output directory to the directory of the temp file (i.e., current directory)
-            output_dir = temp_path.parent
-            logger.info(f"Using output directory: {output_dir}")
+        on_progress('encoding')
+        video_path = output_dir / f"{scene_class}.mp4"
+        with metrics.ENCODE_SECONDS.time(step='concat'):
+            success, message = self.concat_videos([path for path, _ in results], video_path)
+        if not success:
+            return None, "", message
+        logger.info(f"Joined {len(segments)} segments into {video_path}")
+        return video_path, quality, "Rendered in parallel segments"
 
-            # Commands to try with --media_dir set to output_dir
-            commands_to_try = [
-                ["python", "-m", "manim", "-qh", "--media_dir", str(output_dir), temp_file, scene_name],
-                ["python", "-m", "manim", "-qm", "--media_dir", str(output_dir), temp_file, scene_name],  # medium quality
-                ["python", "-m", "manim", "-ql", "--media_dir", str(output_dir), temp_file, scene_name],  # low quality
-                ["manim", "-qh", "--media_dir", str(output_dir), temp_file, scene_name],
-                ["python3", "-m", "manim", "-qh", "--media_dir", str(output_dir), temp_file, scene_name]
-            ]
+    def concat_videos(self, parts: List[Path], output_path: Path) -> Tuple[bool, str]:
+        """Join videos with identical encoding settings using ffmpeg stream copy"""
+        list_file = output_path.with_suffix(".txt")
+        list_file.write_text("".join(
+            "file '{}'\n".format(str(part.resolve()).replace("'", "'\\''")) for part in parts
+        ))
+        cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+               "-i", str(list_file), "-c", "copy", str(output_path)]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.render_timeout)
+        except subprocess.TimeoutExpired:
+            return False, f"ffmpeg concat timed out after {self.render_timeout} seconds"
+        if result.returncode != 0 or not output_path.exists():
+            return False, f"ffmpeg concat failed: {result.stderr}"
+        return True, "Segments joined"
 
-            result = None
-            successful_cmd = None
+    def _render_in_warm_worker(self, manim_code: str, scene_class: str, quality: str,
+                               temp_path: Path, output_dir: Path,
+                               render_progress: Callable[[str], Callable[..., None]],
+                               check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[Optional[Path], str, str]:
+        """Render at one quality through the warm worker pool; returns video path, quality flag, and error.
 
-            for i, cmd in enumerate(commands_to_try):
-                try:
-                    logger.info(f"Attempt {i+1}: Running command: {' '.join(cmd)}")
-                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        There is no quality ladder here: a scene that raises in a worker would fail
+        the same way at a lower quality.
+        """
+        logger.info(f"Rendering {scene_class} {quality} in warm worker")
+        on_progress = render_progress(quality)
+        on_progress('rendering', animation=0)
+        with metrics.RENDER_SECONDS.time(mode='warm', quality=quality):
+            success, video_path, message = self.render_pool.render(
+                manim_code, scene_class, quality, temp_path, output_dir, on_progress,
+                check_cancelled=check_cancelled
+            )
+        metrics.RENDER_ATTEMPTS.inc(mode='warm', quality=quality, outcome='success' if success else 'failed')
+        if not success:
+            logger.warning(f"Warm worker render failed: {message}")
+            return None, "", f"Manim execution failed. Last error: {message}"
+        logger.info(f"Warm worker rendered video: {video_path}")
+        return Path(video_path), quality, message
 
-                    logger.info(f"Command return code: {result.returncode}")
-                    if result.stdout:
-                        logger.info(f"Command stdout: {result.stdout}")
-                    if result.stderr:
-                        logger.warning(f"Command stderr: {result.stderr}")
+    def _run_manim(self, cmd: List[str], on_progress: Callable[..., None],
+                   check_cancelled: Optional[Callable[[], None]] = None) -> subprocess.CompletedProcess:
+        """Run a Manim command, turning its log output into progress updates as it streams.
 
-                    if result.returncode == 0:
-                        successful_cmd = cmd
-                        logger.info(f"Command succeeded: {' '.join(cmd)}")
-                        break
-                    else:
-                        logger.warning(f"Command failed with return code {result.returncode}")
+        The process is killed on timeout, or when check_cancelled raises, which is then re-raised.
+        """
+        # stderr is merged into stdout so progress bars and log lines arrive in order
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+        finished = threading.Event()
+        stopped = {}  # why the watchdog killed the process: 'timeout' or 'cancelled'
 
-                except FileNotFoundError as e:
-                    logger.warning(f"Command not found: {' '.join(cmd)} - {e}")
-                    continue
-                except subprocess.TimeoutExpired:
-                    logger.error(f"Command timed out after 300 seconds: {' '.join(cmd)}")
-                    continue
+        def watchdog():
+            deadline = time.monotonic() + self.render_timeout
+            while not finished.wait(min(CANCEL_POLL_SECONDS, max(0.0, deadline - time.monotonic()))):
+                try:
+                    if check_cancelled:
+                        check_cancelled()
                 except Exception as e:
-                    logger.error(f"Unexpected error running command {' '.join(cmd)}: {e}")
-                    continue
+                    stopped['cancelled'] = e
+                if not stopped and time.monotonic() >= deadline:
+                    stopped['timeout'] = True
+                if stopped:
+                    process.kill()
+                    return
+
+        watcher = threading.Thread(target=watchdog, name="manim-watchdog", daemon=True)
+        watcher.start()
+        output = []
+        last_animation = -1
+        try:
+            # Universal newlines split the progress bar's carriage returns into separate lines
+            for line in process.stdout:
+                match = self.ANIMATION_PATTERN.search(line)
+                if match and int(match.group(1)) > last_animation:
+                    last_animation = int(match.group(1))
+                    on_progress('rendering', animation=last_animation + 1)
+                elif 'Combining to Movie file' in line:
+                    on_progress('encoding')
+                if '%|' not in line:
+                    output.append(line)
+            process.wait()
+        finally:
+            finished.set()
+            watcher.join()
+            if process.poll() is None:
+                process.kill()
+        if 'cancelled' in stopped:
+            raise stopped['cancelled']
+        if 'timeout' in stopped:
+            raise subprocess.TimeoutExpired(cmd, self.render_timeout)
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout="", stderr="".join(output))
 
-            # Clean up temp file
-            logger.info("Step 5: Cleaning up temporary file")
-            """
+    def _render_in_subprocess(self, scene_class: str, qualities: List[str], temp_file: str, output_dir: Path,
+                              render_progress: Callable[[str], Callable[..., None]],
+                              check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[Optional[Path], str, str]:
+        """Render with a fresh Manim process; returns video path, quality flag, and last error"""
+        # Walk down the quality ladder, then try alternative Manim entry points
+        commands_to_try = [
+            ["python", "-m", "manim", quality, "--media_dir", str(output_dir), temp_file, scene_class]
+            for quality in qualities
+        ] + [
+            ["manim", qualities[0], "--media_dir", str(output_dir), temp_file, scene_class],
+            ["python3", "-m", "manim", qualities[0], "--media_dir", str(output_dir), temp_file, scene_class]
+        ]
+
+        result = None
+        successful_cmd = None
+
+        for i, cmd in enumerate(commands_to_try):
             try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-                    logger.info(f"Removed temporary file: {temp_file}")
-            except Exception as e:
-                logger.warning(f"Failed to remove temporary file: {e}")
-            """
-
-            if result and result.returncode == 0:
-                logger.info("Step 6: Manim execution successful, looking for generated video")
-
-                # Search for video files in the output directory and common Manim subfolders there
-                search_directories = [
-                    output_dir,
-                    output_dir / "videos",
-                    output_dir / "videos" / "1080p60",
-                    output_dir / "videos" / "720p30",
-                    output_dir / "videos" / "480p15",
-                    output_dir / "videos" / "854x480p30",
-                    output_dir / temp_file.replace('.py', '') / "videos",
-                    output_dir / temp_file.replace('.py', '') / "videos" / "1080p60",
-                    output_dir / temp_file.replace('.py', '') / "videos" / "720p30",
-                    output_dir / temp_file.replace('.py', '') / "videos" / "480p15",
-                ]
-
-                found_videos = []
-                for search_dir in search_directories:
-                    if search_dir.exists():
-                        logger.info(f"Searching in directory: {search_dir}")
-                        for video_file in search_dir.rglob("*.mp4"):
-                            file_age = datetime.now().timestamp() - video_file.stat().st_mtime
-                            if file_age < 300:  # 5 minutes
-                                found_videos.append(video_file)
-                                logger.info(f"Found recent video file: {video_file} (age: {file_age:.1f}s)")
-
-                # Remove duplicates and sort by modification time (newest first)
-                found_videos = list(set(found_videos))
-                found_videos.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-
-                logger.info(f"Total recent video files found: {len(found_videos)}")
-
-                target_video = None
-
-                # Try to find exact scene name video
-                for video in found_videos:
-                    if scene_name in video.name or scene_name.lower() in video.name.lower():
-                        target_video = video
-                        logger.info(f"Found matching scene video: {video}")
-                        break
+                logger.info(f"Attempt {i+1}: Running command: {' '.join(cmd)}")
+                quality = next(arg for arg in cmd if arg.startswith('-q'))
+                on_progress = render_progress(quality)
+                on_progress('rendering', animation=0)
+                with metrics.RENDER_SECONDS.time(mode='subprocess', quality=quality):
+                    result = self._run_manim(cmd, on_progress, check_cancelled)
+                metrics.RENDER_ATTEMPTS.inc(mode='subprocess', quality=quality,
+                                            outcome='success' if result.returncode == 0 else 'failed')
 
-                # If no exact match, pick most recent
-                if not target_video and found_videos:
-                    target_video = found_videos[0]
-                    logger.info(f"Using most recent video: {target_video}")
-
-                if target_video:
-                    # Final path is in the same folder as temp_file with scene_name.mp4
-                    final_path = output_dir / f"{scene_name}.mp4"
-
-                    try:
-                        if target_video != final_path:
-                            shutil.copy2(str(target_video), str(final_path))
-                            logger.info(f"Copied video from {target_video} to {final_path}")
-
-                        if final_path.exists() and final_path.stat().st_size > 0:
-                            logger.info(f"Video generation completed successfully: {final_path}")
-                            logger.info(f"Final video size: {final_path.stat().st_size} bytes")
-                            return True, str(final_path), "Video generated successfully"
-                        else:
-                            error_msg = f"Final video file is empty or missing: {final_path}"
-                            logger.error(error_msg)
-                            return False, "", error_msg
-
-                    except Exception as e:
-                        logger.error(f"Failed to copy video file: {e}")
-                        if target_video.exists() and target_video.stat().st_size > 0:
-                            logger.info(f"Using original video location: {target_video}")
-                            return True, str(target_video), "Video generated successfully"
-                        else:
-                            return False, "", f"Failed to copy video and original is invalid: {e}"
+                logger.info(f"Command return code: {result.returncode}")
+                if result.stdout:
+                    logger.info(f"Command stdout: {result.stdout}")
+                if result.stderr:
+                    logger.warning(f"Command stderr: {result.stderr}")
+
+                if result.returncode == 0:
+                    successful_cmd = cmd
+                    logger.info(f"Command succeeded: {' '.join(cmd)}")
+                    break
                 else:
-                    error_msg = "No suitable video file found after generation"
-                    logger.error(error_msg)
-                    logger.info("Searched directories:")
-                    for search_dir in search_directories:
-                        if search_dir.exists():
-                            logger.info(f"  {search_dir}: {list(search_dir.glob('*'))}")
-                    return False, "", error_msg
-            else:
-                error_msg = f"Manim execution failed. Last error: {result.stderr if result else 'No result'}"
-                logger.error(error_msg)
-                return False, "", error_msg
+                    logger.warning(f"Command failed with return code {result.returncode}")
+                    if "Traceback" in result.stderr:
+                        # A code error fails the same way at every quality and entry point
+                        break
 
-        except Exception as e:
-            logger.error(f"Unexpected error creating video: {e}", exc_info=True)
-            return False, "", str(e)
+            except FileNotFoundError as e:
+                logger.warning(f"Command not found: {' '.join(cmd)} - {e}")
+                metrics.RENDER_ATTEMPTS.inc(mode='subprocess', quality=quality, outcome='not_found')
+                continue
+            except subprocess.TimeoutExpired:
+                logger.error(f"Command timed out after {self.render_timeout} seconds: {' '.join(cmd)}")
+                metrics.RENDER_ATTEMPTS.inc(mode='subprocess', quality=quality, outcome='timeout')
+                continue
+            except JobCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"Unexpected error running command {' '.join(cmd)}: {e}")
+                continue
+
+        if not (result and result.returncode == 0):
+            return None, "", f"Manim execution failed. Last error: {result.stderr if result else 'No result'}"
+
+        logger.info("Step 6: Manim execution successful, resolving output path")
+        quality = next(arg for arg in successful_cmd if arg.startswith('-q'))
+        video_path = self.expected_video_path(output_dir, Path(temp_file).stem, scene_class, quality)
+        if not video_path.exists():
+            return None, "", f"Manim finished but the expected video is missing: {video_path}"
+
+        logger.info(f"Found rendered video: {video_path}")
+        return video_path, quality, "Video rendered"
+
+    def create_video(self, concept: Dict, context: str, qualities: Optional[List[str]] = None,
+                     on_progress: Optional[Callable[..., None]] = None,
+                     check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[bool, str, str]:
+        """Create video from concept and return success status, video path, and logs"""
+        logger.info(f"Starting video creation for concept: {concept.get('title', 'Unknown')}")
+
+        # Check if Manim is available first
+        if not self.manim_available:
+            error_msg = "Manim is not installed or not available in PATH"
+            logger.error(error_msg)
+            return False, "", error_msg
+
+        if on_progress:
+            on_progress('generating_code')
+        success, manim_code, message = self.prepare_scene_code(concept, context, check_cancelled)
+        if not success:
+            return False, "", message
+
+        success, video_path, message, _ = self.render_with_repairs(manim_code, qualities, on_progress,
+                                                                   check_cancelled)
+        return success, video_path, message
 
 class MathVideoAgent:
     """Main application class that orchestrates the entire workflow"""
@@ -456,9 +968,48 @@ class MathVideoAgent:
     def __init__(self, config: Config):
         logger.info("Initializing MathVideoAgent")
         self.config = config
-        self.pdf_processor = PDFProcessor()
-        self.content_analyzer = ContentAnalyzer(config.OPENAI_API_KEY)
-        self.video_generator = ManimVideoGenerator(config.OPENAI_API_KEY)
+        # Forked first, while this process has no threads yet
+        self.pdf_processor = PDFProcessor(PageExtractionPool(config.PDF_EXTRACT_WORKERS))
+        self.pdf_cache = PDFTextCache(Path(config.PDF_CACHE_PATH), config.PDF_CACHE_MAX_ENTRIES)
+        self.sessions = SessionStore(Path(config.SESSION_DB_PATH), config.SESSION_TTL)
+        self.llm_cache = LLMCache(Path(config.LLM_CACHE_PATH), config.LLM_CACHE_TTL, config.LLM_CACHE_MAX_ENTRIES)
+        self.llm = LLMGateway(config.OPENAI_API_KEY, config.OPENAI_BASE_URL, config.LLM_MODEL,
+                              max_concurrency=config.LLM_MAX_CONCURRENCY, max_retries=config.LLM_MAX_RETRIES,
+                              timeout=config.LLM_TIMEOUT, cache=self.llm_cache)
+        self.content_analyzer = ContentAnalyzer(self.llm, concurrency=config.ANALYSIS_CONCURRENCY,
+                                                max_chunks=config.ANALYSIS_MAX_CHUNKS)
+        self.render_cache = RenderCache(Path(config.RENDER_CACHE_FOLDER), config.RENDER_CACHE_MAX_BYTES)
+        self.tex_cache = TexCache(Path(config.TEX_CACHE_FOLDER), config.TEX_CACHE_MAX_BYTES)
+        self.video_index = VideoIndex(Path(config.VIDEO_FOLDER), offload=config.VIDEO_OFFLOAD,
+                                      accel_prefix=config.VIDEO_ACCEL_PREFIX,
+                                      max_age=config.VIDEO_CACHE_MAX_AGE)
+        self.workspaces = WorkspaceManager(
+            Path(config.WORKSPACE_FOLDER), Path(config.VIDEO_FOLDER),
+            source_dir=Path(config.SOURCE_FOLDER) if config.KEEP_SCENE_SOURCE else None,
+            max_video_age=config.VIDEO_MAX_AGE, max_video_bytes=config.VIDEO_QUOTA_BYTES,
+            # a render holds its workspace for at most a few timeouts, so older ones are leftovers
+            max_workspace_age=config.RENDER_TIMEOUT * 4 * (config.MAX_REPAIR_ATTEMPTS + 1),
+            interval=config.DISK_GC_INTERVAL,
+            on_video_removed=lambda path: self.video_index.remove(path.name)
+        )
+        self.workspaces.start()
+        self.render_pool = None
+        if config.RENDER_SERVER_ENABLED:
+            self.render_pool = WarmRenderPool(config.RENDER_WORKERS, config.RENDER_SERVER_MAX_JOBS,
+                                              config.RENDER_TIMEOUT, tex_cache_dir=Path(config.TEX_CACHE_FOLDER))
+        self.video_generator = ManimVideoGenerator(self.llm, render_cache=self.render_cache,
+                                                   tex_cache=self.tex_cache, workspaces=self.workspaces,
+                                                   video_folder=Path(config.VIDEO_FOLDER),
+                                                   source_folder=Path(config.SOURCE_FOLDER) if config.KEEP_SCENE_SOURCE else None,
+                                                   render_pool=self.render_pool,
+                                                   render_timeout=config.RENDER_TIMEOUT,
+                                                   postprocessor=VideoPostProcessor(
+                                                       config.VIDEO_FASTSTART, config.WEB_PROFILE,
+                                                       config.WEB_PROFILE_CRF, timeout=config.RENDER_TIMEOUT),
+                                                   max_repair_attempts=config.MAX_REPAIR_ATTEMPTS,
+                                                   segment_workers=config.RENDER_WORKERS if config.SEGMENT_RENDERING else 0,
+                                                   segment_min_animations=config.SEGMENT_MIN_ANIMATIONS,
+                                                   segment_processes=config.SEGMENT_PROCESSES)
         
         # Create directories
         Path(config.UPLOAD_FOLDER).mkdir(exist_ok=True)
@@ -474,20 +1025,48 @@ class MathVideoAgent:
         logger.debug(f"File {filename} allowed: {allowed}")
         return allowed
     
-    def process_pdf(self, file_path: str) -> Tuple[bool, str, List[Dict]]:
+    def process_pdf(self, file_path: str, digest: Optional[str] = None) -> Tuple[bool, str, List[Dict]]:
         """Process PDF and return extracted content and concepts"""
         logger.info(f"Processing PDF: {file_path}")
         try:
-            # Extract text
-            text = self.pdf_processor.extract_text_from_pdf(file_path)
+            digest = digest or PDFTextCache.hash_file(file_path)
+            budget = self.config.PDF_TEXT_BUDGET
+            
+            cached = self.pdf_cache.get(digest)
+            if cached and (cached.complete or (budget and len(cached.text) >= budget)):
+                logger.info(f"Using cached text for PDF {digest[:12]}, skipping extraction")
+                text = cached.text
+            else:
+                # Extract text, only as much as the analysis will use when a budget is set
+                if budget:
+                    with metrics.PDF_EXTRACT_SECONDS.time(source='budget'):
+                        pages = self.pdf_processor.extract_pages(file_path, max_chars=budget)
+                    complete = sum(len(page) for page in pages) < budget
+                else:
+                    with metrics.PDF_EXTRACT_SECONDS.time(source='parallel'):
+                        pages = self.pdf_processor.extract_pages_parallel(file_path)
+                    complete = True
+                self.pdf_cache.put(digest, file_path, pages, complete)
+                text = "".join(pages)
+            
+            if budget:
+                text = text[:budget]
             if not text.strip():
                 logger.error("No text could be extracted from the PDF")
                 return False, "No text could be extracted from the PDF", []
             
             logger.info(f"Extracted {len(text)} characters from PDF")
             
-            # Analyze content
-            concepts = self.content_analyzer.analyze_content(text)
+            # Analyze content, reusing concepts derived from the same document
+            concepts_key = f"v{ContentAnalyzer.ANALYSIS_VERSION}:{budget}"
+            concepts = self.pdf_cache.get_concepts(digest, concepts_key)
+            if concepts is not None:
+                logger.info(f"Using {len(concepts)} cached concepts, skipping analysis")
+            else:
+                with metrics.CONTENT_ANALYSIS_SECONDS.time():
+                    concepts = self.content_analyzer.analyze_document(text)
+                if concepts:
+                    self.pdf_cache.put_concepts(digest, concepts_key, concepts)
             logger.info(f"Analysis complete: {len(concepts)} concepts identified")
             
             return True, text, concepts
@@ -504,8 +1083,40 @@ app.config.from_object(config)
 # Initialize the agent
 logger.info("Starting application initialization")
 agent = MathVideoAgent(config)
+job_queue = RenderJobQueue(config.RENDER_WORKERS, max_queued=config.MAX_QUEUED_JOBS,
+                           max_queued_per_owner=config.MAX_QUEUED_PER_SESSION)
+speculator = Speculator(
+    job_queue, agent.video_generator, config.SPECULATIVE_TOP_K,
+    preview_qualities=config.PREVIEW_QUALITIES if config.SPECULATIVE_PREVIEW else None
+) if config.SPECULATIVE_GENERATION else None
 logger.info("Application initialization complete")
 
+@app.before_request
+def _start_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def _observe_request(response):
+    """Record handler time per endpoint; streamed bodies such as SSE are not included"""
+    if 'request_started' in g:
+        metrics.HTTP_REQUEST_SECONDS.observe(time.monotonic() - g.request_started,
+                                             endpoint=request.endpoint or 'unmatched', status=response.status_code)
+    return response
+
+def _session_id() -> str:
+    """Id of this browser's server-side session, assigned on first use"""
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+def _too_busy(retry_after: int, message: str):
+    """429 response telling the client when to retry"""
+    metrics.JOBS_REJECTED.inc(endpoint=request.endpoint)
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @app.route('/')
 def index():
     """Main page"""
@@ -529,29 +1140,37 @@ def upload_file():
         logger.info(f"Processing file: {file.filename}")
         
         if file and agent.allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{timestamp}_{filename}"
-            file_path = os.path.join(config.UPLOAD_FOLDER, filename)
-            
-            logger.info(f"Saving file to: {file_path}")
-            file.save(file_path)
-            
-            # Verify file was saved
-            if os.path.exists(file_path):
-                logger.info(f"File saved successfully, size: {os.path.getsize(file_path)} bytes")
+            # Identical uploads reuse the copy already on disk
+            digest = PDFTextCache.hash_stream(file.stream)
+            stored_file = agent.pdf_cache.stored_file(digest)
+            if stored_file and os.path.exists(stored_file):
+                file_path = stored_file
+                logger.info(f"Duplicate upload of {file_path}, not saving another copy")
             else:
-                logger.error("File was not saved successfully")
-                return jsonify({'error': 'File save failed'}), 500
+                filename = secure_filename(file.filename)
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"{timestamp}_{filename}"
+                file_path = os.path.join(config.UPLOAD_FOLDER, filename)
+                
+                logger.info(f"Saving file to: {file_path}")
+                file.save(file_path)
+                
+                # Verify file was saved
+                if os.path.exists(file_path):
+                    logger.info(f"File saved successfully, size: {os.path.getsize(file_path)} bytes")
+                else:
+                    logger.error("File was not saved successfully")
+                    return jsonify({'error': 'File save failed'}), 500
             
             # Process PDF
             logger.info("Starting PDF processing")
-            success, content, concepts = agent.process_pdf(file_path)
+            success, content, concepts = agent.process_pdf(file_path, digest)
             
             if success:
-                # Store in session
-                session['pdf_content'] = content
-                session['pdf_path'] = file_path
+                # Store server-side; the cookie only carries the session id
+                agent.sessions.set(_session_id(), pdf_content=content, pdf_path=file_path, concepts=concepts)
+                if speculator:
+                    speculator.start(_session_id(), concepts, content)
                 
                 logger.info(f"PDF processed successfully, {len(concepts)} concepts found")
                 return jsonify({
@@ -570,14 +1189,86 @@ def upload_file():
         logger.error(f"Upload error: {e}", exc_info=True)
         return jsonify({'error': 'Upload failed'}), 500
 
+def _render_video_job(job, concept: Dict, context: str) -> Dict:
+    """Job task: render a concept and describe the finished video"""
+    generator = agent.video_generator
+    if not config.PROGRESSIVE_RENDERING:
+        success, video_path, message = generator.create_video(concept, context, on_progress=job.report,
+                                                              check_cancelled=job.check_cancelled)
+        if not success:
+            raise RuntimeError(message)
+        result = _video_result(video_path, concept, message, quality='final')
+        result['repairs'] = job.count_events('repairing')
+        return result
+
+    # Progressive mode: return a fast low quality preview first
+    if not generator.manim_available:
+        raise RuntimeError("Manim is not installed or not available in PATH")
+    job.report('generating_code')
+    success, manim_code, message = generator.prepare_scene_code(concept, context, job.check_cancelled)
+    if not success:
+        raise RuntimeError(message)
+
+    success, video_path, message, manim_code = generator.render_with_repairs(
+        manim_code, config.PREVIEW_QUALITIES, job.report, job.check_cancelled
+    )
+    if not success:
+        raise RuntimeError(message)
+
+    result = _video_result(video_path, concept, message, quality='preview')
+    result['repairs'] = job.count_events('repairing')
+    result['upgrading'] = True
+    upgrade = job_queue.submit(
+        lambda upgrade_job: _upgrade_video_job(upgrade_job, result, manim_code),
+        description=f"{concept.get('title', 'Unknown')} (high quality)",
+        priority=PRIORITY_FINAL,  # previews someone is waiting for go first
+        owner=job.owner
+    )
+    result['upgrade_job_id'] = upgrade.id
+    return result
+
+def _upgrade_video_job(job, result: Dict, manim_code: str) -> Dict:
+    """Job task: re-render a previewed scene at full quality and swap it in"""
+    success, video_path, message = agent.video_generator.render_scene(manim_code, config.FINAL_QUALITIES, job.report,
+                                                                      job.check_cancelled)
+    if success:
+        result.update(_video_result(video_path, result['concept'], message, quality='final'))
+        logger.info(f"Upgraded preview to high quality video: {result['video_path']}")
+    else:
+        result['upgrade_error'] = message
+        logger.warning(f"High quality upgrade failed, keeping preview: {message}")
+    result['upgrading'] = False
+
+    if not success:
+        raise RuntimeError(message)
+    return {'video_path': result['video_path']}
+
+def _public_result(job, result: Optional[Dict] = None) -> Dict:
+    """A job's result without server paths; preview, upgrade and speculative jobs return different keys"""
+    result = dict(job.result) if result is None else result  # the upgrade worker may update it concurrently
+    return {k: v for k, v in result.items() if k != 'file_path'}
+
+def _video_result(video_path: str, concept: Dict, message: str, quality: str) -> Dict:
+    """Describe a rendered video for the job status endpoints"""
+    agent.video_index.add(Path(video_path))
+    return {
+        'video_path': f"/videos/{os.path.basename(video_path)}",
+        'file_path': video_path,
+        'concept': concept,
+        'message': message,
+        'quality': quality,
+        'generated_at': datetime.now().isoformat()
+    }
+
 @app.route('/generate_video', methods=['POST'])
 def generate_video():
-    """Generate video for selected concept"""
+    """Queue video generation for selected concept"""
     logger.info("Generate video endpoint called")
     try:
         data = request.get_json()
         concept_index = data.get('concept_index')
-        concepts = data.get('concepts', [])
+        # Concepts from this session's upload; older clients still post them back
+        concepts = agent.sessions.get(_session_id(), 'concepts') or data.get('concepts', [])
         
         logger.info(f"Request data: concept_index={concept_index}, concepts_count={len(concepts)}")
         
@@ -586,46 +1277,215 @@ def generate_video():
             return jsonify({'error': 'Invalid concept selection'}), 400
         
         concept = concepts[concept_index]
-        context = session.get('pdf_content', '')
+        context = agent.sessions.get(_session_id(), 'pdf_content', '')
         
         logger.info(f"Selected concept: {concept.get('title', 'Unknown')}")
         logger.info(f"Context length: {len(context)} characters")
         
-        # Generate video
-        logger.info("Starting video generation")
-        success, video_path, message = agent.video_generator.create_video(concept, context)
+        # A quick check first, so a refused request leaves its speculation alone
+        admitted, retry_after, message = job_queue.admit(_session_id())
+        if not admitted:
+            return _too_busy(retry_after, message)
         
-        if success:
-            session['current_video'] = {
-                'path': video_path,
-                'concept': concept,
-                'generated_at': datetime.now().isoformat()
-            }
-
-            # Return relative URL to video for client to request
-            video_url = f"/videos/{os.path.basename(video_path)}"
-
-            logger.info(f"Video generation successful: {video_url}")
-            return jsonify({
-                'success': True,
-                'video_path': video_url,
-                'concept': concept,
-                'message': message
-            })
-        else:
-            logger.error(f"Video generation failed: {message}")
-            return jsonify({'error': message}), 500
+        # Hand the render to the worker pool and return straight away; a claimed speculation
+        # runs first, and the code and preview it leaves in the caches are reused
+        speculative = speculator.claim(_session_id(), concept) if speculator else None
+        job, retry_after, message = job_queue.try_submit(
+            lambda job: _render_video_job(job, concept, context),
+            description=concept.get('title', 'Unknown'),
+            owner=_session_id(),
+            after=speculative
+        )
+        if not job:
+            return _too_busy(retry_after, message)
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f"/jobs/{job.id}",
+            'events_url': f"/jobs/{job.id}/events"
+        }), 202
             
     except Exception as e:
         logger.error(f"Video generation error: {e}", exc_info=True)
         return jsonify({'error': 'Video generation failed'}), 500
 
+@app.route('/generate_batch', methods=['POST'])
+def generate_batch():
+    """Queue videos for several concepts of the current document, rendering identical concepts once"""
+    logger.info("Generate batch endpoint called")
+    try:
+        data = request.get_json() or {}
+        indices = data.get('concept_indices')
+        sid = _session_id()
+        concepts = agent.sessions.get(sid, 'concepts') or []
+        if indices is None:
+            indices = list(range(len(concepts)))
+        
+        if not indices or not all(isinstance(i, int) and 0 <= i < len(concepts) for i in indices):
+            logger.warning(f"Invalid batch selection: indices={indices}, available={len(concepts)}")
+            return jsonify({'error': 'Invalid concept selection'}), 400
+        
+        # A quick check first, so a refused request leaves its speculation alone
+        admitted, retry_after, message = job_queue.admit(sid)
+        if not admitted:
+            return _too_busy(retry_after, message)
+        
+        context = agent.sessions.get(sid, 'pdf_content', '')
+        
+        # Identical concepts (or repeated indices) share one render
+        tasks = []
+        claimed = []  # speculation each task waits for
+        task_by_key: Dict[str, int] = {}
+        items = []
+        for index in indices:
+            concept = concepts[index]
+            key = json.dumps(concept, sort_keys=True)
+            if key not in task_by_key:
+                task_by_key[key] = len(tasks)
+                claimed.append(speculator.claim(sid, concept) if speculator else None)
+                tasks.append((lambda job, concept=concept: _render_video_job(job, concept, context),
+                              concept.get('title', 'Unknown')))
+            items.append({'concept_index': index, 'task': task_by_key[key]})
+        
+        batch, retry_after, message = job_queue.try_submit_batch(tasks, config.BATCH_MAX_PARALLEL, owner=sid,
+                                                                 after=claimed)
+        if not batch:
+            return _too_busy(retry_after, message)
+        batch.items = items
+        logger.info(f"Batch {batch.id}: {len(indices)} concepts, {len(tasks)} unique renders")
+        
+        return jsonify({
+            'success': True,
+            'batch_id': batch.id,
+            'items': len(items),
+            'renders': len(tasks),
+            'status_url': f"/batches/{batch.id}"
+        }), 202
+    
+    except Exception as e:
+        logger.error(f"Batch generation error: {e}", exc_info=True)
+        return jsonify({'error': 'Batch generation failed'}), 500
+
+@app.route('/batches/<batch_id>')
+def batch_status(batch_id):
+    """Report per-item status and results of a batch"""
+    batch = job_queue.get_batch(batch_id)
+    if not batch:
+        return jsonify({'error': 'Batch not found'}), 404
+    
+    items = []
+    counts = {JOB_QUEUED: 0, JOB_RENDERING: 0, JOB_DONE: 0, JOB_FAILED: 0}
+    for item in batch.items:
+        job_id = batch.job_ids[item['task']]
+        job = job_queue.get(job_id) if job_id else None
+        if job:
+            status = job.status
+        else:
+            status = 'expired' if job_id else JOB_QUEUED  # pruned, or not yet released to the queue
+        counts[status] = counts.get(status, 0) + 1
+        entry = {'concept_index': item['concept_index'], 'job_id': job_id, 'status': status}
+        if job:
+            entry.update({
+                'stage': job.stage,
+                'status_url': f"/jobs/{job.id}",
+                'result': _public_result(job),
+                'error': job.error,
+            })
+        items.append(entry)
+    
+    return jsonify({
+        'batch_id': batch.id,
+        'status': JOB_DONE if batch.finished else JOB_RENDERING,
+        'created_at': batch.created_at.isoformat(),
+        'renders': batch.size,
+        'max_parallel': batch.max_parallel,
+        'counts': counts,
+        'items': items
+    })
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the status of a queued render job"""
+    logger.debug(f"Job status requested: {job_id}")
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    payload = job.to_dict()
+    result = dict(job.result)  # the upgrade worker may update it concurrently
+    payload['result'] = _public_result(job, result)
+    
+    # Upgrade and speculative jobs only describe their render, not a video for the session
+    if job.status == JOB_DONE and 'file_path' in result:
+        # Remember the finished video for download and follow-up questions
+        agent.sessions.set(_session_id(), current_video={
+            'path': result['file_path'],
+            'concept': result['concept'],
+            'generated_at': result['generated_at']
+        })
+    
+    return jsonify(payload)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream a render job's stage and progress updates as Server-Sent Events"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    # Reconnecting clients resume after the last event they saw
+    try:
+        last_id = max(0, int(request.headers.get('Last-Event-ID') or request.args.get('after', 0)))
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID and after must be event ids'}), 400
+    
+    if job.stage in (JOB_DONE, JOB_FAILED, JOB_CANCELLED) and last_id >= len(job.events):
+        # The final event was already delivered; 204 stops EventSource from reconnecting
+        return Response(status=204)
+    
+    def stream():
+        nonlocal last_id
+        while True:
+            events = job.wait_for_events(last_id, timeout=config.SSE_KEEPALIVE_SECONDS)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                last_id = event['id']
+                yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+            if events[-1]['stage'] in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+                return
+    
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # let nginx pass events through unbuffered
+    })
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Return the finished video of a render job"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job.status == JOB_DONE:
+        return jsonify({'success': True, 'upgrading': False, **_public_result(job)})
+    if job.status == JOB_FAILED:
+        return jsonify({'error': job.error, 'status': job.status}), 500
+    if job.status == JOB_CANCELLED:
+        # Final: the video will never be ready, so polling clients must stop
+        return jsonify({'error': job.error or 'Job was cancelled', 'status': job.status}), 410
+    
+    return jsonify({'success': False, 'status': job.status, 'message': 'Video is not ready yet'}), 202
+
 @app.route('/download_video')
 def download_video():
     """Download the generated video"""
     logger.info("Download video endpoint called")
     try:
-        video_info = session.get('current_video')
+        video_info = agent.sessions.get(_session_id(), 'current_video')
         if not video_info:
             logger.warning("No video available for download")
             return jsonify({'error': 'No video available for download'}), 404
@@ -633,17 +1493,21 @@ def download_video():
         video_path = video_info['path']
         logger.info(f"Attempting to download video: {video_path}")
         
-        if not os.path.exists(video_path):
+        entry = agent.video_index.get(os.path.basename(video_path))
+        if not entry:
             logger.error(f"Video file not found: {video_path}")
             return jsonify({'error': 'Video file not found'}), 404
         
         logger.info(f"Serving video file: {video_path}")
-        return send_file(
-            video_path,
+        return agent.video_index.send(
+            entry,
             as_attachment=True,
             download_name=f"math_video_{video_info['concept']['title'].replace(' ', '_')}.mp4"
         )
         
+    except FileNotFoundError:
+        logger.error(f"Video file was deleted: {video_info['path']}")
+        return jsonify({'error': 'Video file not found'}), 404
     except Exception as e:
         logger.error(f"Download error: {e}", exc_info=True)
         return jsonify({'error': 'Download failed'}), 500
@@ -651,28 +1515,24 @@ def download_video():
 @app.route('/videos/<filename>')
 def serve_video(filename):
     """Serve video files from the videos directory"""
-    logger.info(f"Serving video file: {filename}")
+    logger.debug(f"Serving video file: {filename} (Range: {request.headers.get('Range')})")
     try:
-        video_path = os.path.join(config.VIDEO_FOLDER, filename)
-        
-        # Security check - ensure the file exists and is in the videos directory
-        if not os.path.exists(video_path):
-            logger.error(f"Video file not found: {video_path}")
-            return jsonify({'error': 'Video file not found'}), 404
-        
-        # Additional security check - ensure filename doesn't contain path traversal
+        # Security check - ensure filename doesn't contain path traversal
         if '..' in filename or '/' in filename or '\\' in filename:
             logger.warning(f"Invalid filename detected: {filename}")
             return jsonify({'error': 'Invalid filename'}), 400
         
-        logger.info(f"Serving video: {video_path}")
-        return send_file(
-            video_path,
-            mimetype='video/mp4',
-            as_attachment=False,  # Stream the video instead of downloading
-            download_name=filename
-        )
+        # Metadata comes from the index, so repeat views and seeks skip the filesystem
+        entry = agent.video_index.get(filename)
+        if not entry:
+            logger.error(f"Video file not found: {filename}")
+            return jsonify({'error': 'Video file not found'}), 404
+        
+        return agent.video_index.send(entry)  # streamed inline rather than downloaded
         
+    except FileNotFoundError:
+        logger.error(f"Video file was deleted: {filename}")
+        return jsonify({'error': 'Video file not found'}), 404
     except Exception as e:
         logger.error(f"Error serving video {filename}: {e}", exc_info=True)
         return jsonify({'error': 'Failed to serve video'}), 500
@@ -691,37 +1551,30 @@ def ask_question():
             logger.warning("Empty question provided")
             return jsonify({'error': 'Please provide a question'}), 400
         
-        video_info = session.get('current_video')
+        video_info = agent.sessions.get(_session_id(), 'current_video')
         if not video_info:
             logger.warning("No video context available")
             return jsonify({'error': 'No video context available'}), 404
         
-        # Use OpenAI to answer the question
-        client = OpenAI(
-            api_key=config.OPENAI_API_KEY,
-            base_url="https://openrouter.ai/api/v1"
-        )
-        
         context = f"""
         Video concept: {video_info['concept']['title']}
         Description: {video_info['concept']['description']}
         Type: {video_info['concept']['type']}
         Key concepts: {', '.join(video_info['concept'].get('key_concepts', []))}
         
-        Original PDF content: {session.get('pdf_content', '')[:1000]}
+        Original PDF content: {agent.sessions.get(_session_id(), 'pdf_content', '')[:1000]}
         """
         
         logger.info("Sending question to OpenAI")
-        response = client.chat.completions.create(
-            model="deepseek/deepseek-r1-0528:free",
+        answer = agent.llm.chat(
             messages=[
                 {"role": "system", "content": "You are a helpful mathematics tutor answering questions about educational videos and mathematical concepts."},
                 {"role": "user", "content": f"Context: {context}\n\nQuestion: {question}"}
             ],
-            temperature=0.3
+            temperature=0.3,
+            use_cache=False
         )
         
-        answer = response.choices[0].message.content
         logger.info(f"Answer generated: {len(answer)} characters")
         
         return jsonify({
@@ -734,6 +1587,28 @@ def ask_question():
         logger.error(f"Question answering error: {e}", exc_info=True)
         return jsonify({'error': 'Failed to answer question'}), 500
 
+@app.route('/cache_stats')
+def cache_stats():
+    """Report hit/miss counters and sizes of the render, TeX, LLM and PDF text caches"""
+    logger.info("Cache stats endpoint called")
+    return jsonify({
+        'render_cache': agent.render_cache.stats(),
+        'tex_cache': agent.tex_cache.stats(),
+        'llm_cache': agent.llm_cache.stats(),
+        'llm_gateway': agent.llm.stats(),
+        'pdf_cache': agent.pdf_cache.stats(),
+        'sessions': agent.sessions.stats(),
+        'disk': agent.workspaces.stats(),
+        'video_index': agent.video_index.stats(),
+        'speculation': speculator.stats() if speculator else None,
+        'jobs': job_queue.stats()
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Per-stage latency histograms and counters in Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype=None, content_type=metrics.Registry.CONTENT_TYPE)
+
 @app.route('/test_manim')
 def test_manim():
     """Test endpoint to check if Manim is working"""
@@ -746,15 +1621,19 @@ def test_manim():
         
         if manim_available:
             # Try to get version info
-            try:
-                result = subprocess.run(['python', '-m', 'manim', '--version'], 
-                                      capture_output=True, text=True, timeout=10)
-                if result.returncode == 0:
-                    version_info = result.stdout.strip()
-                else:
-                    version_info = "Version check failed"
-            except:
-                version_info = "Could not retrieve version"
+            render_pool = agent.video_generator.render_pool
+            if render_pool and render_pool.available():
+                version_info = f"Manim Community v{render_pool.version} (warm render workers)"
+            else:
+                try:
+                    result = subprocess.run(['python', '-m', 'manim', '--version'], 
+                                          capture_output=True, text=True, timeout=10)
+                    if result.returncode == 0:
+                        version_info = result.stdout.strip()
+                    else:
+                        version_info = "Version check failed"
+                except:
+                    version_info = "Could not retrieve version"
             
             logger.info(f"Manim test successful: {version_info}")
             return jsonify({
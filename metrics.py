@@ -0,0 +1,175 @@
+"""
+Per-stage latency histograms and event counters in Prometheus text format.
+Modules record into the metrics defined at the bottom of this file and
+/metrics renders them all, so each stage of the pipeline (PDF extraction,
+LLM calls, validation, Manim rendering, encoding and video delivery) can be
+scraped and compared without parsing log lines.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Seconds, spanning sub-millisecond cache hits to multi-minute renders
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels"""
+
+    kind = 'counter'
+
+    @property
+    def family_name(self) -> str:
+        # Samples carry the _total suffix, and the text format wants HELP/TYPE under the sample name
+        return f"{self.name}_total"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by labels"""
+
+    kind = 'histogram'
+
+    @property
+    def family_name(self) -> str:
+        return self.name
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the wall time of a block, whether or not it raises"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.family_name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.family_name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+PDF_EXTRACT_SECONDS = REGISTRY.register(Histogram(
+    'pdf_extract_seconds', 'Time to extract text from an uploaded PDF', ['source']))
+CONTENT_ANALYSIS_SECONDS = REGISTRY.register(Histogram(
+    'content_analysis_seconds', 'Time to derive concepts from a document'))
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'llm_request_seconds', 'LLM request latency, including retries', ['mode']))
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.register(Histogram(
+    'llm_first_token_seconds', 'Time to the first streamed LLM token'))
+LLM_TOKENS = REGISTRY.register(Histogram(
+    'llm_tokens', 'Tokens per LLM request', ['type'], buckets=TOKEN_BUCKETS))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    'llm_requests', 'LLM requests by outcome', ['outcome']))
+VALIDATION_SECONDS = REGISTRY.register(Histogram(
+    'scene_validation_seconds', 'Time to parse and validate generated scene code'))
+RENDER_SECONDS = REGISTRY.register(Histogram(
+    'manim_render_seconds', 'Manim render time per attempt', ['mode', 'quality']))
+RENDER_ATTEMPTS = REGISTRY.register(Counter(
+    'render_attempts', 'Manim render attempts by mode, quality and outcome', ['mode', 'quality', 'outcome']))
+RENDER_FALLBACKS = REGISTRY.register(Counter(
+    'render_fallbacks', 'Renders that fell back to a slower path', ['reason']))
+RENDER_RESULTS = REGISTRY.register(Counter(
+    'render_results', 'Completed render_scene calls by outcome', ['outcome']))
+REPAIR_ATTEMPTS = REGISTRY.register(Counter(
+    'repair_attempts', 'LLM repairs of scene code after a failed render'))
+ENCODE_SECONDS = REGISTRY.register(Histogram(
+    'video_encode_seconds', 'Time to concatenate, remux or transcode rendered video', ['step']))
+VIDEO_STORE_SECONDS = REGISTRY.register(Histogram(
+    'video_store_seconds', 'Time to move or link a finished video into the output folder', ['source']))
+JOBS_REJECTED = REGISTRY.register(Counter(
+    'jobs_rejected', 'Render requests refused by admission control', ['endpoint']))
+VIDEO_RESPONSES = REGISTRY.register(Counter(
+    'video_responses', 'Video responses by status code', ['status']))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_seconds', 'Time to produce a response, excluding streamed bodies', ['endpoint', 'status']))
@@ -0,0 +1,135 @@
+"""
+Cache of extracted PDF text keyed by file content hash.
+Stores per-page text, the concepts derived from it and where the upload was
+saved, so a duplicate upload skips saving, extraction and analysis.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+
+from sqlite_store import SQLiteCache
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPDF:
+    """Cached extraction results for one PDF"""
+
+    def __init__(self, digest: str, file_path: str, pages: List[str], complete: bool):
+        self.digest = digest
+        self.file_path = file_path
+        self.pages = pages
+        self.complete = complete
+
+    @property
+    def text(self) -> str:
+        return "".join(self.pages)
+
+
+class PDFTextCache(SQLiteCache):
+    """SQLite store of extracted page text and concepts keyed by PDF content hash"""
+
+    def __init__(self, db_path: Path, max_entries: int):
+        super().__init__(db_path, [
+            """
+                CREATE TABLE IF NOT EXISTS pdfs (
+                    digest TEXT PRIMARY KEY,
+                    file_path TEXT NOT NULL,
+                    pages TEXT NOT NULL,
+                    complete INTEGER NOT NULL,
+                    concepts_key TEXT,
+                    concepts TEXT,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_pdfs_accessed ON pdfs (accessed_at)",
+        ])
+        self.max_entries = max_entries
+        logger.info(f"PDF text cache at {self.db_path.absolute()} (max {max_entries} documents)")
+
+    @staticmethod
+    def hash_stream(stream: BinaryIO) -> str:
+        """SHA-256 of a file object's contents, leaving it rewound"""
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+            digest.update(chunk)
+        stream.seek(0)
+        return digest.hexdigest()
+
+    @classmethod
+    def hash_file(cls, file_path: str) -> str:
+        """SHA-256 of a file on disk"""
+        with open(file_path, 'rb') as f:
+            return cls.hash_stream(f)
+
+    def stored_file(self, digest: str) -> Optional[str]:
+        """Path the PDF was saved to on its first upload, if known"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT file_path FROM pdfs WHERE digest = ?", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, digest: str) -> Optional[CachedPDF]:
+        """Return cached extraction results for a PDF, or None on a miss"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT file_path, pages, complete FROM pdfs WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE pdfs SET accessed_at = ? WHERE digest = ?", (time.time(), digest))
+
+        self._count_lookup(hit=bool(row))
+        if not row:
+            logger.info(f"PDF cache miss: {digest[:12]}")
+            return None
+        logger.info(f"PDF cache hit: {digest[:12]}")
+        return CachedPDF(digest, row[0], json.loads(row[1]), bool(row[2]))
+
+    def put(self, digest: str, file_path: str, pages: List[str], complete: bool):
+        """Store extracted pages; concepts are dropped because the text changed"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pdfs (digest, file_path, pages, complete, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, file_path, json.dumps(pages), int(complete), now, now)
+            )
+            conn.execute(
+                "DELETE FROM pdfs WHERE digest IN ("
+                "SELECT digest FROM pdfs ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def get_concepts(self, digest: str, concepts_key: str) -> Optional[List[Dict]]:
+        """Concepts previously derived from this PDF with the same analysis settings"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT concepts FROM pdfs WHERE digest = ? AND concepts_key = ?", (digest, concepts_key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_concepts(self, digest: str, concepts_key: str, concepts: List[Dict]):
+        """Attach derived concepts to a cached PDF"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE pdfs SET concepts_key = ?, concepts = ? WHERE digest = ?",
+                (concepts_key, json.dumps(concepts), digest)
+            )
+
+    def stats(self) -> Dict:
+        """Hit/miss counters, number of documents and stored text size"""
+        with self._connect() as conn:
+            entries, text_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(pages) + COALESCE(LENGTH(concepts), 0)), 0) FROM pdfs"
+            ).fetchone()
+        return {
+            **self._lookup_stats(),
+            'entries': entries,
+            'bytes': text_bytes,
+            'db_bytes': self.db_path.stat().st_size if self.db_path.exists() else 0,
+            'max_entries': self.max_entries,
+        }
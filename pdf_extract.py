@@ -0,0 +1,78 @@
+"""
+Process pool for extracting the text of large PDFs in parallel.
+main.py is run as a script and builds the app at import time, so spawn and
+forkserver workers would re-run that setup. The workers are forked instead,
+all at once when the pool is created, which MathVideoAgent does before it
+starts any threads; forking later from the threaded server could deadlock a
+child on a lock held at fork time. A pool that breaks is not re-forked, large
+documents are then extracted sequentially.
+"""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Tuple
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+
+def extract_page_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) in a worker process"""
+    with fitz.open(file_path) as doc:
+        return [doc[page_num].get_text() for page_num in range(start, stop)]
+
+
+class PageExtractionPool:
+    """Worker processes forked at startup that extract page ranges of a PDF"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+        if workers <= 1:
+            return
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            logger.info("fork is not available, PDFs are extracted sequentially")
+            return
+        if threading.active_count() > 1:
+            logger.warning("Threads are already running, PDFs are extracted sequentially")
+            return
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        # A fork-context executor launches all its processes on the first submit, so fork them now
+        self._pool.submit(int).result()
+        logger.info(f"Started {workers} PDF extraction processes")
+
+    def available(self) -> bool:
+        with self._lock:
+            return self._pool is not None
+
+    def extract(self, file_path: str, ranges: List[Tuple[int, int]]) -> List[str]:
+        """Text of every page in the ranges, in order; raises if the pool is unavailable or fails"""
+        with self._lock:
+            pool = self._pool
+        if pool is None:
+            raise RuntimeError("PDF extraction pool is not available")
+        try:
+            futures = [pool.submit(extract_page_range, file_path, start, stop) for start, stop in ranges]
+            return [page_text for future in futures for page_text in future.result()]
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+
+    def _discard(self, pool: ProcessPoolExecutor):
+        """Drop a broken pool for good, re-forking from the threaded server is what this avoids"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.error("PDF extraction pool broke, extracting sequentially from now on")
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,139 @@
+"""
+Content-addressed cache of rendered Manim videos.
+Videos are keyed on a hash of the normalized scene source, the scene class
+and the Manim quality flag, and evicted least-recently-used once the cache
+grows past its size budget.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(src: Path, dst: Path):
+    """Hard link src to dst, falling back to a copy across filesystems"""
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class RenderCache:
+    """Size-bounded LRU cache of MP4 files keyed on scene source"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+
+        existing = sorted(self.cache_dir.glob("*.mp4"), key=lambda p: p.stat().st_mtime)
+        for video in existing:
+            self._entries[video.stem] = video.stat().st_size
+        logger.info(f"Render cache at {self.cache_dir.absolute()}: {len(self._entries)} videos, "
+                    f"{self.total_bytes} bytes (limit {self.max_bytes})")
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._entries.values())
+
+    @staticmethod
+    def normalize_source(code: str) -> str:
+        """Normalize line endings, trailing whitespace and blank lines"""
+        lines = [line.rstrip() for line in code.replace('\r\n', '\n').replace('\r', '\n').split('\n')]
+        return '\n'.join(line for line in lines if line)
+
+    @classmethod
+    def make_key(cls, code: str, scene_name: str, quality: str) -> str:
+        """Hash of normalized source, scene class and quality flag"""
+        digest = hashlib.sha256()
+        for part in (cls.normalize_source(code), scene_name, quality):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.mp4"
+
+    def get(self, code: str, scene_name: str, quality: str) -> Optional[Path]:
+        """Return the cached video at exactly this quality, or None on a miss.
+
+        The file can still be evicted before the caller links it, so callers
+        treat FileNotFoundError as a miss.
+        """
+        key = self.make_key(code, scene_name, quality)
+        path = self._path(key)
+        with self._lock:
+            if key in self._entries and path.exists():
+                self._entries.move_to_end(key)
+                os.utime(path)  # keep LRU order across restarts
+                self.hits += 1
+                logger.info(f"Render cache hit: {scene_name} {quality} ({key[:12]})")
+                return path
+            self._entries.pop(key, None)
+            self.misses += 1
+            logger.info(f"Render cache miss: {scene_name} {quality}")
+            return None
+
+    def put(self, code: str, scene_name: str, quality: str, video_path: Path) -> Optional[Path]:
+        """Store a rendered video and evict down to the size limit"""
+        key = self.make_key(code, scene_name, quality)
+        video_path = Path(video_path)
+        try:
+            size = video_path.stat().st_size
+            if size > self.max_bytes:
+                logger.warning(f"Video {video_path} ({size} bytes) exceeds render cache size, not caching")
+                return None
+
+            with self._lock:
+                path = self._path(key)
+                tmp_path = path.with_suffix('.tmp')
+                link_or_copy(video_path, tmp_path)
+                os.replace(tmp_path, path)
+                self._entries[key] = size
+                self._entries.move_to_end(key)
+                self._evict()
+            logger.info(f"Cached rendered video {video_path} as {key[:12]}")
+            return path
+        except Exception as e:
+            logger.warning(f"Failed to cache rendered video {video_path}: {e}")
+            return None
+
+    def _evict(self):
+        """Remove least recently used videos until under the size limit"""
+        while self._entries and self.total_bytes > self.max_bytes:
+            key, size = self._entries.popitem(last=False)
+            try:
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+            logger.info(f"Evicted cached video {key[:12]} ({size} bytes)")
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
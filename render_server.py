@@ -0,0 +1,328 @@
+"""
+Warm Manim render workers.
+Each worker is a long-lived Python process that imports Manim once and then
+renders scene source sent to it over a JSON-lines pipe, so per-video latency
+no longer includes interpreter and library start-up. Workers are recycled
+after a fixed number of jobs to bound memory growth.
+
+Running this file directly starts a single worker speaking the protocol on
+stdin/stdout. While rendering, a worker sends progress messages ahead of the
+job result. Workers given a TeX cache directory link cached SVGs into place
+for each expression Manim is about to compile.
+"""
+
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from tex_cache import TexCache
+
+logger = logging.getLogger(__name__)
+
+# Manim CLI quality flags and their names in manim.constants.QUALITIES
+QUALITY_NAMES = {
+    '-ql': 'low_quality',
+    '-qm': 'medium_quality',
+    '-qh': 'high_quality',
+    '-qp': 'production_quality',
+    '-qk': 'fourk_quality',
+}
+
+CANCEL_POLL_SECONDS = 0.5  # how often a waiting render checks whether its job was cancelled
+
+
+class RenderWorkerError(Exception):
+    """A warm worker crashed, timed out or could not start"""
+
+
+class RenderWorker:
+    """Parent-side handle of one warm render process"""
+
+    def __init__(self, python: str):
+        self.jobs_done = 0
+        self.ready_info: Optional[Dict] = None
+        self.process = subprocess.Popen(
+            [python, str(Path(__file__).resolve())],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+        self._lines: 'queue.Queue[Optional[str]]' = queue.Queue()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        logger.info(f"Started warm render worker pid {self.process.pid}")
+
+    def _read_loop(self):
+        """Forward protocol lines from the worker; None marks end of stream"""
+        for line in self.process.stdout:
+            if line.startswith('{'):
+                self._lines.put(line)
+        self._lines.put(None)
+
+    def receive(self, timeout: float) -> Optional[Dict]:
+        """Next message from the worker, or None on timeout or exit"""
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return json.loads(line) if line else None
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Wait for the worker to finish importing Manim"""
+        if self.ready_info is None:
+            self.ready_info = self.receive(timeout) or {'ready': False, 'error': 'worker did not start'}
+        return bool(self.ready_info.get('ready'))
+
+    def request(self, message: Dict, timeout: float,
+                on_progress: Optional[Callable[..., None]] = None,
+                check_cancelled: Optional[Callable[[], None]] = None) -> Optional[Dict]:
+        """Send one job and wait for its result, forwarding progress messages.
+
+        check_cancelled is polled while waiting; whatever it raises is passed on
+        with the worker still busy rendering.
+        """
+        try:
+            self.process.stdin.write(json.dumps(message) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            return None
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = max(0.0, deadline - time.monotonic())
+            if check_cancelled:
+                check_cancelled()
+                remaining = min(remaining, CANCEL_POLL_SECONDS)
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                if check_cancelled and time.monotonic() < deadline:
+                    continue
+                return None
+            response = json.loads(line) if line else None
+            if response is None or 'progress' not in response:
+                return response
+            if on_progress:
+                progress = dict(response['progress'])
+                on_progress(progress.pop('stage'), **progress)
+
+    def stop(self):
+        """Ask the worker to exit, killing it if it does not"""
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+        logger.info(f"Stopped warm render worker pid {self.process.pid} after {self.jobs_done} jobs")
+
+    def kill(self):
+        """Kill the worker without waiting for its current render"""
+        self.process.kill()
+        self.process.wait()
+        logger.info(f"Killed warm render worker pid {self.process.pid} mid-render")
+
+
+class WarmRenderPool:
+    """Pool of warm render workers shared by the render job threads"""
+
+    def __init__(self, size: int, max_jobs_per_worker: int, timeout: int,
+                 python: str = sys.executable, startup_timeout: int = 120, tex_cache_dir: Optional[Path] = None):
+        self.size = max(1, size)
+        self.tex_cache_dir = tex_cache_dir
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.timeout = timeout
+        self.python = python
+        self.startup_timeout = startup_timeout
+        self.version = ''
+        self._available: Optional[bool] = None
+        self._idle: 'queue.Queue[RenderWorker]' = queue.Queue()
+
+        logger.info(f"Starting warm render pool with {self.size} workers")
+        for _ in range(self.size):
+            self._idle.put(RenderWorker(self.python))
+
+    def available(self) -> bool:
+        """Whether workers can import Manim; waits for one worker on first call"""
+        if self._available is None:
+            worker = self._idle.get()
+            try:
+                self._available = worker.wait_ready(self.startup_timeout)
+                if self._available:
+                    self.version = worker.ready_info.get('version', '')
+                    logger.info(f"Warm render workers ready, Manim {self.version}")
+                else:
+                    logger.warning(f"Warm render workers unavailable: {worker.ready_info.get('error')}")
+            finally:
+                self._idle.put(worker)
+        return self._available
+
+    def render(self, code: str, scene_name: str, quality: str, file_path: Path, media_dir: Path,
+               on_progress: Optional[Callable[..., None]] = None,
+               animations: Optional[Tuple[int, int]] = None,
+               check_cancelled: Optional[Callable[[], None]] = None) -> Tuple[bool, str, str]:
+        """Render a scene in a warm worker; returns success, video path, and error output.
+
+        animations limits the render to an inclusive range of animation indices.
+        If check_cancelled raises mid-render, the worker is killed and replaced
+        and the exception propagates.
+        """
+        worker = self._idle.get()
+        try:
+            if not worker.wait_ready(self.startup_timeout):
+                worker = self._replace(worker)
+                raise RenderWorkerError("render worker failed to start")
+
+            try:
+                response = worker.request({
+                    'code': code,
+                    'scene_name': scene_name,
+                    'quality': quality,
+                    'file_path': str(file_path),
+                    'media_dir': str(media_dir),
+                    'animations': list(animations) if animations else None,
+                    'tex_cache_dir': str(self.tex_cache_dir.resolve()) if self.tex_cache_dir else None,
+                }, self.timeout, on_progress, check_cancelled)
+            except Exception:
+                # Cancelled: the worker is still rendering the abandoned scene
+                worker = self._replace(worker, kill=True)
+                raise
+            if response is None:
+                worker = self._replace(worker)
+                raise RenderWorkerError(f"render worker timed out after {self.timeout} seconds or exited")
+
+            worker.jobs_done += 1
+            if worker.jobs_done >= self.max_jobs_per_worker:
+                logger.info(f"Recycling render worker pid {worker.process.pid}")
+                worker = self._replace(worker)
+
+            if response.get('ok'):
+                return True, response['video_path'], "Rendered in warm worker"
+            return False, "", response.get('error', 'Unknown render error')
+        finally:
+            self._idle.put(worker)
+
+    def _replace(self, worker: RenderWorker, kill: bool = False) -> RenderWorker:
+        """Stop (or kill) a worker and start a fresh one in its place"""
+        if kill:
+            worker.kill()
+        elif worker.process.poll() is None:
+            worker.stop()
+        else:
+            logger.warning(f"Render worker pid {worker.process.pid} exited with code {worker.process.returncode}")
+        return RenderWorker(self.python)
+
+    def shutdown(self):
+        """Stop all idle workers"""
+        while not self._idle.empty():
+            self._idle.get_nowait().stop()
+
+
+def _report_progress(scene, send: Callable[[Dict], None]):
+    """Worker side: announce each animation and the final encode of a scene"""
+    renderer = getattr(scene, 'renderer', None)
+    if renderer is None or not hasattr(renderer, 'file_writer'):
+        return
+    play = renderer.play
+    finish = renderer.file_writer.finish
+
+    def reporting_play(*args, **kwargs):
+        send({'progress': {'stage': 'rendering', 'animation': renderer.num_plays + 1}})
+        return play(*args, **kwargs)
+
+    def reporting_finish(*args, **kwargs):
+        send({'progress': {'stage': 'encoding'}})
+        return finish(*args, **kwargs)
+
+    renderer.play = reporting_play
+    renderer.file_writer.finish = reporting_finish
+
+
+def _use_tex_cache(job: Dict):
+    """Worker side: have Manim find cached SVGs for the expressions this job compiles"""
+    from manim.utils import tex_file_writing
+
+    generate = getattr(tex_file_writing, '_generate_tex_file', tex_file_writing.generate_tex_file)
+    tex_file_writing._generate_tex_file = generate
+    cache_dir = job.get('tex_cache_dir')
+    if not cache_dir:
+        tex_file_writing.generate_tex_file = generate
+        return
+
+    def generate_tex_file(*args, **kwargs):
+        # Manim skips latex and dvisvgm when the SVG next to the .tex file already exists
+        tex_file = generate(*args, **kwargs)
+        TexCache.link_cached(Path(cache_dir), Path(tex_file))
+        return tex_file
+    tex_file_writing.generate_tex_file = generate_tex_file
+
+
+def _render_job(job: Dict, send: Callable[[Dict], None]) -> Dict:
+    """Worker side: render one scene in-process with an isolated config"""
+    import manim
+    from manim.constants import QUALITIES
+
+    module_name = Path(job['file_path']).stem
+    module = types.ModuleType(module_name)
+    module.__file__ = job['file_path']
+    sys.modules[module_name] = module
+    try:
+        _use_tex_cache(job)
+        quality = QUALITIES[QUALITY_NAMES[job['quality']]]
+        overrides = {
+            'pixel_height': quality['pixel_height'],
+            'pixel_width': quality['pixel_width'],
+            'frame_rate': quality['frame_rate'],
+            'media_dir': job['media_dir'],
+            'input_file': job['file_path'],
+        }
+        if job.get('animations'):
+            # Same as the CLI's -n start,end
+            overrides['from_animation_number'], overrides['upto_animation_number'] = job['animations']
+        with manim.tempconfig(overrides):
+            # Module-level config edits in the scene are undone with the overrides
+            exec(compile(job['code'], job['file_path'], 'exec'), module.__dict__)
+            scene = getattr(module, job['scene_name'])()
+            _report_progress(scene, send)
+            scene.render()
+            video_path = scene.renderer.file_writer.movie_file_path
+        return {'ok': True, 'video_path': str(video_path)}
+    except Exception:
+        return {'ok': False, 'error': traceback.format_exc()}
+    finally:
+        sys.modules.pop(module_name, None)
+
+
+def serve():
+    """Worker main loop: import Manim once, then render jobs from stdin"""
+    # Keep stdout for the protocol; anything Manim prints goes to stderr
+    protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+    os.dup2(2, 1)
+
+    def send(message: Dict):
+        protocol.write(json.dumps(message) + "\n")
+        protocol.flush()
+
+    try:
+        import manim
+    except Exception as e:
+        send({'ready': False, 'error': str(e)})
+        return
+    send({'ready': True, 'version': manim.__version__, 'pid': os.getpid()})
+
+    for line in sys.stdin:
+        if line.strip():
+            send(_render_job(json.loads(line), send))
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,243 @@
+"""
+Static checks for LLM-generated Manim scene code.
+Parses the cleaned code with ast before any Manim process is spawned so that
+broken scripts fail fast, applies a few safe repairs, and detects the name of
+the Scene class to render and how many animations it plays. Also extracts the
+code block from streamed LLM responses.
+"""
+
+import ast
+import logging
+import textwrap
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIM_IMPORT = "from manim import *"
+ANIMATION_METHODS = {'play', 'wait', 'pause', 'wait_until'}
+# Constructs that can run their body zero or many times
+_REPEATING_NODES = (ast.For, ast.AsyncFor, ast.While, ast.If, ast.IfExp, ast.Try, ast.ListComp,
+                    ast.SetComp, ast.DictComp, ast.GeneratorExp, ast.Lambda, ast.FunctionDef)
+
+
+class ValidatedScene:
+    """Scene code that passed validation, with the class Manim should render"""
+
+    def __init__(self, code: str, scene_name: str, repairs: List[str], animations: Optional[int] = None):
+        self.code = code
+        self.scene_name = scene_name
+        self.repairs = repairs
+        self.animations = animations  # play()/wait() calls, None when not statically known
+
+
+class CodeFenceExtractor:
+    """Incrementally pull the Python code block out of a streamed LLM response.
+
+    Text outside the block is dropped line by line as it arrives, and feed()
+    returns the code as soon as the closing fence is seen so the caller can stop
+    the stream. A response that starts directly with code is taken whole.
+    """
+
+    CODE_LANGUAGES = {'', 'python', 'python3', 'py'}
+    CODE_STARTS = ('from ', 'import ', 'class ')
+
+    def __init__(self):
+        self.code: Optional[str] = None
+        self.discarded = 0  # characters of preamble and prose dropped
+        self._state = 'prose'  # prose, code, raw (unfenced code) or other (non-Python block)
+        self._seen_prose = False
+        self._partial = ""
+        self._lines: List[str] = []
+
+    @property
+    def done(self) -> bool:
+        return self.code is not None
+
+    def feed(self, text: str) -> Optional[str]:
+        """Consume streamed text; returns the code once the block is complete"""
+        if self.done:
+            return self.code
+        *lines, self._partial = (self._partial + text).split('\n')
+        for line in lines:
+            self._consume_line(line)
+            if self.done:
+                break
+        return self.code
+
+    def finish(self) -> Optional[str]:
+        """End of stream: return the code, accepting an unterminated block"""
+        if not self.done:
+            if self._partial:
+                self._consume_line(self._partial)
+                self._partial = ""
+            if not self.done and self._state in ('code', 'raw') and self._lines:
+                self._close_block()
+        return self.code
+
+    def _consume_line(self, line: str):
+        stripped = line.strip()
+        # Fences may follow prose on the same line, e.g. "Sure! ```python"
+        fence = line.find('```')
+        if self._state == 'prose':
+            if fence >= 0:
+                self.discarded += fence
+                self._open_block(line[fence + 3:])
+            elif stripped and not self._seen_prose and stripped.startswith(self.CODE_STARTS):
+                self._state = 'raw'
+                self._lines.append(line)
+            else:
+                self._seen_prose = self._seen_prose or bool(stripped)
+                self.discarded += len(line) + 1
+        elif self._state == 'other':
+            if stripped.startswith('```'):
+                self._state = 'prose'
+            self.discarded += len(line) + 1
+        elif fence >= 0:
+            if line[:fence].strip():
+                self._lines.append(line[:fence])
+            self._close_block()
+        else:
+            self._lines.append(line)
+
+    def _open_block(self, rest: str):
+        """Start a block from the text after its opening fence: a language tag, then possibly code"""
+        language, code = ('', rest) if rest[:1].isspace() or not rest else (rest.split(None, 1) + [''])[:2]
+        self._state = 'code' if language.lower() in self.CODE_LANGUAGES else 'other'
+        if code.strip():
+            self._consume_line(code.strip())
+
+    def _close_block(self):
+        self.code = "\n".join(self._lines).strip("\n") + "\n"
+        self._lines = []
+        logger.info(f"Extracted {len(self.code)} characters of code, discarded {self.discarded}")
+
+
+def _base_name(node: ast.expr) -> str:
+    """Name of a base class expression such as Scene or manim.Scene"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return ""
+
+
+def _imports_manim(tree: ast.Module) -> bool:
+    """Whether the module imports anything from manim"""
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module and node.module.split('.')[0] == 'manim':
+            return True
+        if isinstance(node, ast.Import) and any(alias.name.split('.')[0] == 'manim' for alias in node.names):
+            return True
+    return False
+
+
+def find_scene_classes(tree: ast.Module) -> List[ast.ClassDef]:
+    """Top-level classes deriving from a Manim Scene, directly or via a local subclass"""
+    classes: Dict[str, ast.ClassDef] = {
+        node.name: node for node in tree.body if isinstance(node, ast.ClassDef)
+    }
+    scene_names = set()
+    changed = True
+    while changed:
+        changed = False
+        for name, node in classes.items():
+            if name in scene_names:
+                continue
+            for base in node.bases:
+                base_name = _base_name(base)
+                if base_name.endswith('Scene') or base_name in scene_names:
+                    scene_names.add(name)
+                    changed = True
+                    break
+    return [node for name, node in classes.items() if name in scene_names]
+
+
+def _has_construct(node: ast.ClassDef, classes: Dict[str, ast.ClassDef]) -> bool:
+    """Whether the class or one of its local bases defines construct()"""
+    for item in node.body:
+        if isinstance(item, ast.FunctionDef) and item.name == 'construct':
+            return True
+    for base in node.bases:
+        base_node = classes.get(_base_name(base))
+        if base_node is not None and base_node is not node and _has_construct(base_node, classes):
+            return True
+    return False
+
+
+def _is_animation_call(node: ast.AST) -> bool:
+    """Whether the node is a self.play()-style call that renders one animation"""
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and \
+        node.func.attr in ANIMATION_METHODS and \
+        isinstance(node.func.value, ast.Name) and node.func.value.id == 'self'
+
+
+def count_animations(scene: ast.ClassDef) -> Optional[int]:
+    """Number of animations construct() plays, or None if it cannot be known statically"""
+    methods = {item.name: item for item in scene.body if isinstance(item, ast.FunctionDef)}
+    construct = methods.get('construct')
+    if construct is None:
+        return None
+    for name, method in methods.items():
+        if name != 'construct' and any(_is_animation_call(node) for node in ast.walk(method)):
+            return None
+
+    count = 0
+    for node in ast.walk(construct):
+        if node is construct:
+            continue
+        if isinstance(node, _REPEATING_NODES) and any(_is_animation_call(child) for child in ast.walk(node)):
+            return None
+        if isinstance(node, ast.Call) and any(isinstance(arg, ast.Name) and arg.id == 'self' for arg in node.args):
+            return None  # a helper function may play animations on the scene
+        if _is_animation_call(node):
+            count += 1
+    return count
+
+
+def validate_scene_code(code: str) -> Tuple[bool, Optional[ValidatedScene], str]:
+    """Parse, repair and inspect scene code; returns success, validated scene and message"""
+    repairs = []
+
+    expanded = code.expandtabs(4)
+    dedented = textwrap.dedent(expanded)
+    if expanded != code or \
+            [line for line in dedented.splitlines() if line.strip()] != \
+            [line for line in expanded.splitlines() if line.strip()]:
+        repairs.append("normalized indentation")
+    repaired = dedented.strip() + "\n"
+
+    try:
+        tree = ast.parse(repaired)
+    except SyntaxError as e:
+        error_msg = f"Generated code has a syntax error at line {e.lineno}: {e.msg}"
+        logger.error(error_msg)
+        return False, None, error_msg
+
+    if not _imports_manim(tree):
+        repaired = f"{MANIM_IMPORT}\n\n{repaired}"
+        tree = ast.parse(repaired)
+        repairs.append("added manim import")
+
+    scene_classes = find_scene_classes(tree)
+    if not scene_classes:
+        error_msg = "Generated code does not define a Scene subclass"
+        logger.error(error_msg)
+        return False, None, error_msg
+
+    classes = {node.name: node for node in tree.body if isinstance(node, ast.ClassDef)}
+    renderable = [node for node in scene_classes if _has_construct(node, classes)]
+    if not renderable:
+        error_msg = f"Scene class {scene_classes[0].name} has no construct() method"
+        logger.error(error_msg)
+        return False, None, error_msg
+
+    # Prefer the most derived scene when the code defines helper base scenes
+    base_names = {_base_name(base) for node in renderable for base in node.bases}
+    leaves = [node for node in renderable if node.name not in base_names]
+    scene = (leaves or renderable)[-1]
+
+    if repairs:
+        logger.info(f"Repaired generated code: {', '.join(repairs)}")
+    logger.info(f"Validated scene code, rendering class {scene.name}")
+    return True, ValidatedScene(repaired, scene.name, repairs, count_animations(scene)), \
+        f"Scene {scene.name} is valid"
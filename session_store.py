@@ -0,0 +1,88 @@
+"""
+Server-side store of per-browser session state.
+Flask's default session is a signed cookie, so storing the extracted PDF text
+in it sent the whole document with every request and broke past the ~4KB
+cookie limit. The cookie now carries only a session id; the PDF text,
+concepts and current video are kept here in SQLite, one row per value, so a
+request reads just the values it needs. Sessions idle for longer than the
+TTL are deleted. Reads refresh a session's access time only once it is a
+few minutes old, so most reads never take SQLite's write lock.
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(SQLiteStore):
+    """SQLite-backed key/value state per session id, expired after a period of inactivity"""
+
+    def __init__(self, db_path: Path, ttl_seconds: int):
+        super().__init__(db_path, [
+            """
+                CREATE TABLE IF NOT EXISTS session_values (
+                    session_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, key)
+                )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_session_values_accessed ON session_values (accessed_at)",
+        ])
+        self.ttl_seconds = ttl_seconds
+        self.touch_interval = max(1, min(300, ttl_seconds // 10))  # seconds between access time updates on read
+        self.expired = 0
+        logger.info(f"Session store at {self.db_path.absolute()} (ttl {ttl_seconds}s)")
+
+    def get(self, session_id: str, key: str, default: Any = None) -> Any:
+        """Return one value of a session, or default if missing or expired"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, accessed_at FROM session_values WHERE session_id = ? AND key = ?",
+                (session_id, key)
+            ).fetchone()
+            if not row or now - row[1] > self.ttl_seconds:
+                return default
+            # Reading keeps the whole session alive; a coarse access time is enough for expiry
+            if now - row[1] > self.touch_interval:
+                conn.execute("UPDATE session_values SET accessed_at = ? WHERE session_id = ?", (now, session_id))
+        return json.loads(row[0])
+
+    def set(self, session_id: str, **values: Any):
+        """Store values for a session and delete expired sessions"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_values (session_id, key, value, accessed_at) VALUES (?, ?, ?, ?)",
+                [(session_id, key, json.dumps(value), now) for key, value in values.items()]
+            )
+            conn.execute("UPDATE session_values SET accessed_at = ? WHERE session_id = ?", (now, session_id))
+            expired = conn.execute(
+                "DELETE FROM session_values WHERE accessed_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+        if expired:
+            with self._lock:
+                self.expired += expired
+            logger.info(f"Expired {expired} stale session values")
+
+    def stats(self) -> Dict:
+        """Number of live sessions and stored size"""
+        with self._connect() as conn:
+            sessions, value_bytes = conn.execute(
+                "SELECT COUNT(DISTINCT session_id), COALESCE(SUM(LENGTH(value)), 0) FROM session_values"
+            ).fetchone()
+        with self._lock:
+            return {
+                'sessions': sessions,
+                'bytes': value_bytes,
+                'expired_values': self.expired,
+                'ttl_seconds': self.ttl_seconds,
+            }
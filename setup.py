@@ -7,6 +7,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         "Flask>=2.3.3",
+        "httpx>=0.27.2",
         "PyPDF2>=3.0.1",
         "PyMuPDF>=1.23.5",
         "openai>=1.3.5",
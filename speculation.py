@@ -0,0 +1,108 @@
+"""
+Speculative pre-generation of likely video requests.
+Once an upload has been analysed, code generation (and optionally a preview
+render) for the top-ranked concepts is queued at speculative priority. The
+results land in the LLM and render caches, so when the user then picks one
+of those concepts its job skips the LLM round trip. Speculative jobs give way
+to real requests: the queue cancels them when it gets busy, and a click on a
+concept that has not started speculating yet cancels it in favour of the
+normal job.
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from jobs import PRIORITY_NORMAL, PRIORITY_SPECULATIVE, RenderJob, RenderJobQueue, JOB_QUEUED
+
+logger = logging.getLogger(__name__)
+
+
+class Speculator:
+    """Queues low-priority code generation for the top concepts of each session's upload"""
+
+    def __init__(self, job_queue: RenderJobQueue, generator, top_k: int = 3,
+                 preview_qualities: Optional[List[str]] = None):
+        self.job_queue = job_queue
+        self.generator = generator
+        self.top_k = max(0, top_k)
+        self.preview_qualities = preview_qualities  # None generates code only
+        self._jobs: Dict[Tuple[str, str], RenderJob] = {}  # (session id, concept key) -> job
+        self._lock = threading.Lock()
+        self._stats = {'started': 0, 'claimed_running': 0, 'claimed_finished': 0, 'claimed_queued': 0}
+
+    @staticmethod
+    def concept_key(concept: Dict) -> str:
+        return json.dumps(concept, sort_keys=True)
+
+    def start(self, session_id: str, concepts: List[Dict], context: str):
+        """Speculate on the top-K concepts of a fresh upload, replacing the session's earlier speculation"""
+        self.cancel(session_id, "new upload")
+        with self._lock:
+            # Finished speculation has already filled the caches; only in-flight jobs are worth claiming
+            self._jobs = {key: job for key, job in self._jobs.items() if not job.finished}
+        for concept in concepts[:self.top_k]:
+            job = self.job_queue.submit(
+                lambda job, concept=concept: self._speculate(job, concept, context),
+                description=f"{concept.get('title', 'Unknown')} (speculative)",
+                priority=PRIORITY_SPECULATIVE,
+                owner=session_id
+            )
+            with self._lock:
+                self._jobs[(session_id, self.concept_key(concept))] = job
+                self._stats['started'] += 1
+        logger.info(f"Speculating on {min(self.top_k, len(concepts))} concepts for session {session_id[:8]}")
+
+    def _speculate(self, job: RenderJob, concept: Dict, context: str) -> Dict:
+        """Job task: generate (and optionally preview-render) a concept, filling the caches"""
+        job.report('generating_code')
+        # Cancellation stops the LLM stream mid-response, not just between steps
+        success, manim_code, message = self.generator.prepare_scene_code(concept, context, job.check_cancelled)
+        if not success or not self.preview_qualities or not self.generator.manim_available:
+            return {'code_generated': success}
+        # Cancellation kills the preview render rather than letting it hold a render worker
+        success, video_path, message = self.generator.render_scene(manim_code, self.preview_qualities, job.report,
+                                                                   job.check_cancelled)
+        return {'code_generated': True, 'preview_rendered': success}
+
+    def claim(self, session_id: str, concept: Dict) -> Optional[RenderJob]:
+        """Take over the speculation for a concept the user picked.
+
+        Returns a started or finished job whose cached output the real job can
+        wait for, or None. Speculation that has not started yet is cancelled, as
+        the real job will do the same work at normal priority.
+        """
+        with self._lock:
+            job = self._jobs.pop((session_id, self.concept_key(concept)), None)
+        if job is None:
+            return None
+        with job._changed:
+            if job.status == JOB_QUEUED:
+                claimed = None
+            else:
+                job.priority = PRIORITY_NORMAL  # no longer speculative, so never cancelled for load
+                claimed = job
+        if claimed is None:
+            job.cancel("claimed before it started")
+            self._count('claimed_queued')
+        else:
+            self._count('claimed_finished' if job.finished else 'claimed_running')
+        return claimed
+
+    def cancel(self, session_id: str, reason: str):
+        """Cancel a session's outstanding speculation"""
+        with self._lock:
+            keys = [key for key in self._jobs if key[0] == session_id]
+            jobs = [self._jobs.pop(key) for key in keys]
+        for job in jobs:
+            job.cancel(reason)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> Dict:
+        """Speculation started and how the user's picks used it"""
+        with self._lock:
+            return {**self._stats, 'outstanding': sum(1 for job in self._jobs.values() if not job.finished)}
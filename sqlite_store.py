@@ -0,0 +1,61 @@
+"""
+Shared base for the SQLite-backed caches and stores.
+Each store is a single database file in WAL mode, so readers do not block the
+writer, accessed through short-lived connections that are safe to open from
+any request or worker thread.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+
+class SQLiteStore:
+    """A WAL-mode SQLite database created with the given schema statements"""
+
+    def __init__(self, db_path: Path, schema: List[str]):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in schema:
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a short-lived connection that commits on success"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+class SQLiteCache(SQLiteStore):
+    """SQLiteStore that counts cache hits and misses"""
+
+    def __init__(self, db_path: Path, schema: List[str]):
+        super().__init__(db_path, schema)
+        self.hits = 0
+        self.misses = 0
+
+    def _count_lookup(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _lookup_stats(self) -> Dict:
+        """Hit and miss counters and the hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
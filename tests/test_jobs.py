@@ -0,0 +1,218 @@
+import threading
+import time
+
+import pytest
+
+from jobs import (JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RENDERING, PRIORITY_FINAL,
+                  PRIORITY_SPECULATIVE, RenderJobQueue)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class Blocker:
+    """Occupies every worker of a queue until released, so later jobs stay queued"""
+
+    def __init__(self, queue: RenderJobQueue, owner: str = 'blocker'):
+        self.gate = threading.Event()
+        self.jobs = [queue.submit(lambda job: self.gate.wait(5) and {}, owner=owner) for _ in range(queue.workers)]
+        wait_until(lambda: all(job.status == JOB_RENDERING for job in self.jobs))
+
+    def release(self):
+        self.gate.set()
+
+
+def recorder(order, name):
+    def task(job):
+        order.append(name)
+        return {'name': name}
+    return task
+
+
+def test_lower_priority_values_run_first_and_fifo_within_a_priority():
+    queue = RenderJobQueue(1)
+    blocker = Blocker(queue)
+    order = []
+    jobs = [
+        queue.submit(recorder(order, 'speculative'), priority=PRIORITY_SPECULATIVE),
+        queue.submit(recorder(order, 'final'), priority=PRIORITY_FINAL),
+        queue.submit(recorder(order, 'preview-1')),
+        queue.submit(recorder(order, 'preview-2')),
+    ]
+    blocker.release()
+    for job in jobs:
+        assert job.wait(5)
+    assert order == ['preview-1', 'preview-2', 'final']
+    assert jobs[0].status == JOB_CANCELLED  # a preview arrived while the worker was busy
+
+
+def test_owners_take_turns_within_a_priority():
+    queue = RenderJobQueue(1)
+    blocker = Blocker(queue)
+    order = []
+    jobs = [queue.submit(recorder(order, f'a{i}'), owner='a') for i in range(3)]
+    jobs += [queue.submit(recorder(order, f'b{i}'), owner='b') for i in range(2)]
+    blocker.release()
+    for job in jobs:
+        assert job.wait(5)
+    assert order == ['a0', 'b0', 'a1', 'b1', 'a2']
+
+
+def test_speculation_does_not_cost_its_owner_fair_share():
+    queue = RenderJobQueue(2)
+    gate = threading.Event()
+    speculative = queue.submit(lambda job: gate.wait(5) and {}, priority=PRIORITY_SPECULATIVE, owner='a')
+    wait_until(lambda: speculative.status == JOB_RENDERING)
+    assert queue.stats()['owners_running'] == 0
+    gate.set()
+    assert speculative.wait(5)
+
+
+def test_job_outcomes():
+    queue = RenderJobQueue(1)
+    done = queue.submit(lambda job: {'ok': True})
+    failed = queue.submit(lambda job: 1 / 0)
+    assert done.wait(5) and failed.wait(5)
+    assert done.status == JOB_DONE and done.result == {'ok': True}
+    assert failed.status == JOB_FAILED and 'division by zero' in failed.error
+    assert [event['stage'] for event in done.events][-1] == JOB_DONE
+
+
+def test_job_waits_for_the_job_it_follows_without_holding_a_worker():
+    queue = RenderJobQueue(2)
+    gate = threading.Event()
+    first = queue.submit(lambda job: gate.wait(5) and {})
+    wait_until(lambda: first.status == JOB_RENDERING)
+    order = []
+    chained = queue.submit(recorder(order, 'chained'), after=first)
+    other = queue.submit(recorder(order, 'other'))
+    assert other.wait(5)
+    assert chained.status == JOB_QUEUED
+    gate.set()
+    assert chained.wait(5)
+    assert order == ['other', 'chained']
+
+
+def test_cancelled_queued_job_never_runs():
+    queue = RenderJobQueue(1)
+    blocker = Blocker(queue)
+    order = []
+    job = queue.submit(recorder(order, 'cancelled'))
+    assert job.cancel("not needed")
+    blocker.release()
+    assert job.wait(5)
+    assert job.status == JOB_CANCELLED and order == []
+    assert not job.cancel("again")
+
+
+def test_running_job_stops_at_check_cancelled():
+    queue = RenderJobQueue(1)
+    started = threading.Event()
+
+    def task(job):
+        started.set()
+        while True:
+            job.check_cancelled()
+            time.sleep(0.01)
+
+    job = queue.submit(task)
+    assert started.wait(5)
+    assert job.cancel("user left")
+    assert job.wait(5)
+    assert job.status == JOB_CANCELLED and job.error == "user left"
+
+
+def test_busy_queue_cancels_speculation_for_real_work():
+    queue = RenderJobQueue(1)
+    blocker = Blocker(queue)
+    speculative = queue.submit(lambda job: {}, priority=PRIORITY_SPECULATIVE)
+    queue.submit(lambda job: {})
+    assert speculative.status == JOB_CANCELLED
+    blocker.release()
+
+
+@pytest.mark.parametrize('max_queued, per_owner, message', [
+    (2, 0, "The server is busy"),
+    (0, 2, "You already have 2 videos waiting"),
+])
+def test_admission_limits(max_queued, per_owner, message):
+    queue = RenderJobQueue(1, max_queued=max_queued, max_queued_per_owner=per_owner)
+    blocker = Blocker(queue)
+    assert queue.admit('a')[0]
+    queue.submit(lambda job: {}, owner='a')
+    queue.submit(lambda job: {}, owner='a')
+    admitted, retry_after, refusal = queue.admit('a')
+    assert not admitted and retry_after >= 1 and refusal.startswith(message)
+    blocker.release()
+
+
+def test_admission_ignores_jobs_that_run_after_the_new_one():
+    queue = RenderJobQueue(1, max_queued=2, max_queued_per_owner=2)
+    blocker = Blocker(queue)
+    for _ in range(3):
+        queue.submit(lambda job: {}, priority=PRIORITY_FINAL, owner='a')
+    queue.submit(lambda job: {}, priority=PRIORITY_SPECULATIVE, owner='a')
+    assert queue.admit('a')[0]
+    assert queue.admit('b')[0]
+    assert not queue.admit('a', priority=PRIORITY_FINAL)[0]
+    blocker.release()
+
+
+def test_concurrent_submissions_cannot_overshoot_the_limit():
+    queue = RenderJobQueue(1, max_queued=5)
+    blocker = Blocker(queue)
+    start = threading.Barrier(20)
+    results = []
+
+    def request():
+        start.wait()
+        results.append(queue.try_submit(lambda job: {}, owner='a')[0])
+
+    threads = [threading.Thread(target=request) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(1 for job in results if job) == 5
+    blocker.release()
+
+
+def test_unreleased_batch_tasks_count_toward_admission():
+    queue = RenderJobQueue(1, max_queued=10, max_queued_per_owner=3)
+    blocker = Blocker(queue)
+    batch, _, _ = queue.try_submit_batch([(lambda job: {}, f'item {i}') for i in range(8)], max_parallel=8,
+                                         owner='a')
+    assert batch.max_parallel == 3  # capped by the per-owner limit
+    assert sum(1 for job_id in batch.job_ids if job_id) == 3
+    assert not queue.admit('a')[0]
+    assert queue.admit('b')[0]
+    queue.try_submit_batch([(lambda job: {}, f'b{i}') for i in range(2)], max_parallel=1, owner='b')
+    assert not queue.admit('c')[0]  # 4 queued and 6 unreleased
+    blocker.release()
+
+
+def test_batch_runs_at_most_max_parallel_jobs_at_once():
+    queue = RenderJobQueue(4)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def task(job):
+        with lock:
+            running.append(job.id)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(job.id)
+        return {}
+
+    batch = queue.submit_batch([(task, f'item {i}') for i in range(6)], max_parallel=2, owner='a')
+    wait_until(lambda: batch.finished and all(batch.job_ids))
+    jobs = [queue.get(job_id) for job_id in batch.job_ids]
+    assert all(job.status == JOB_DONE and job.owner == 'a' for job in jobs)
+    assert max(peak) <= 2
@@ -0,0 +1,70 @@
+import types
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def make_cache(tmp_path, ttl_seconds=60, max_entries=10):
+    return LLMCache(tmp_path / 'llm.db', ttl_seconds, max_entries)
+
+
+def test_key_depends_on_model_temperature_and_messages():
+    messages = [{'role': 'user', 'content': 'integrals'}]
+    key = LLMCache.make_key('model', 0.2, messages)
+    assert key == LLMCache.make_key('model', 0.2, [dict(messages[0])])
+    assert key != LLMCache.make_key('other', 0.2, messages)
+    assert key != LLMCache.make_key('model', 0.7, messages)
+    assert key != LLMCache.make_key('model', 0.2, [{'role': 'user', 'content': 'limits'}])
+
+
+def test_hits_and_misses_are_counted(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    assert cache.get('a') is None
+    cache.put('a', 'model', 'response')
+    assert cache.get('a') == 'response'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate'], stats['entries']) == (1, 1, 0.5, 1)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_seconds=60)
+    cache.put('a', 'model', 'response')
+    clock[0] += 60
+    assert cache.get('a') == 'response'
+    clock[0] += 1
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    for key in ('a', 'b'):
+        cache.put(key, 'model', key)
+        clock[0] += 1
+    assert cache.get('a') == 'a'
+    clock[0] += 1
+    cache.put('c', 'model', 'c')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'a' and cache.get('c') == 'c'
+
+
+def test_delete(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put('a', 'model', 'response')
+    assert cache.delete('a')
+    assert not cache.delete('a')
+    assert cache.get('a') is None
+
+
+def test_entries_survive_a_restart(tmp_path, clock):
+    make_cache(tmp_path).put('a', 'model', 'response')
+    assert make_cache(tmp_path).get('a') == 'response'
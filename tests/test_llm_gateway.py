@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import pytest
+
+from llm_cache import LLMCache
+from llm_gateway import LLMGateway
+
+MESSAGES = [{'role': 'user', 'content': 'Explain the chain rule'}]
+
+
+class StubClient:
+    """Stands in for the OpenAI client, answering every request with the next reply"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        content = self.replies.pop(0)
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+        if kwargs.get('stream'):
+            return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))], usage=None)
+                         for part in content] + [SimpleNamespace(choices=[], usage=usage)])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMCache(tmp_path / 'llm.db', ttl_seconds=60, max_entries=10)
+
+
+def make_gateway(client, cache=None):
+    return LLMGateway('key', 'http://llm.invalid', 'model', cache=cache, client=client)
+
+
+def test_identical_requests_are_answered_from_the_cache(cache):
+    client = StubClient('first', 'second')
+    gateway = make_gateway(client, cache)
+    assert gateway.chat(MESSAGES, 0.2) == 'first'
+    assert gateway.chat(MESSAGES, 0.2) == 'first'
+    assert gateway.chat(MESSAGES, 0.7) == 'second'
+    assert len(client.requests) == 2
+    stats = gateway.stats()
+    assert (stats['calls'], stats['cache_hits'], stats['prompt_tokens'], stats['completion_tokens']) == (2, 1, 20, 10)
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 2)
+
+
+def test_cache_can_be_bypassed(cache):
+    client = StubClient('first', 'second')
+    gateway = make_gateway(client, cache)
+    gateway.chat(MESSAGES, 0.2)
+    assert gateway.chat(MESSAGES, 0.2, use_cache=False) == 'second'
+
+
+def test_invalidate_sends_the_next_request_to_the_model(cache):
+    client = StubClient('broken code', 'fixed code')
+    gateway = make_gateway(client, cache)
+    gateway.chat(MESSAGES, 0.2)
+    assert gateway.invalidate(MESSAGES, 0.2)
+    assert not gateway.invalidate(MESSAGES, 0.2)
+    assert gateway.chat(MESSAGES, 0.2) == 'fixed code'
+
+
+def test_invalidate_without_a_cache():
+    assert not make_gateway(StubClient()).invalidate(MESSAGES, 0.2)
+
+
+def test_completed_stream_is_cached(cache):
+    client = StubClient(['from ', 'manim ', 'import *'])
+    gateway = make_gateway(client, cache)
+    assert list(gateway.stream_chat(MESSAGES, 0.2)) == ['from ', 'manim ', 'import *']
+    assert list(gateway.stream_chat(MESSAGES, 0.2)) == ['from manim import *']
+    assert len(client.requests) == 1
+    assert gateway.stats()['streams'] == 1
+
+
+def test_stream_closed_early_is_cached_only_when_complete(cache):
+    client = StubClient(['```python\n', 'x = 1\n', '```', '\nprose'], ['```python\n', 'x = 1\n', '```', '\nprose'])
+    gateway = make_gateway(client, cache)
+
+    stream = gateway.stream_chat(MESSAGES, 0.2, complete=lambda: False)
+    next(stream)
+    stream.close()
+    assert cache.stats()['entries'] == 0
+
+    received = []
+    stream = gateway.stream_chat(MESSAGES, 0.2, complete=lambda: '```' in ''.join(received[1:]))
+    for delta in stream:
+        received.append(delta)
+        if len(received) == 3:
+            break
+    stream.close()
+    assert list(gateway.stream_chat(MESSAGES, 0.2)) == ['```python\nx = 1\n```']
+    assert len(client.requests) == 2
@@ -0,0 +1,84 @@
+from scene_code import CodeFenceExtractor, validate_scene_code
+
+
+def extract(response: str, chunk_size: int = 7) -> str:
+    """Feed a response in small chunks, as a stream would arrive"""
+    extractor = CodeFenceExtractor()
+    for start in range(0, len(response), chunk_size):
+        if extractor.feed(response[start:start + chunk_size]) is not None:
+            break
+    return extractor.finish()
+
+
+def test_fenced_block_after_preamble():
+    response = "Here is the scene:\n```python\nfrom manim import *\nclass A(Scene):\n    pass\n```\nEnjoy!"
+    assert extract(response) == "from manim import *\nclass A(Scene):\n    pass\n"
+
+
+def test_fence_after_prose_on_the_same_line():
+    response = "Sure! ```python\nfrom manim import *\nclass A(Scene):\n    pass\n```"
+    assert extract(response) == "from manim import *\nclass A(Scene):\n    pass\n"
+
+
+def test_code_on_the_opening_fence_line():
+    assert extract("Sure! ```python from manim import *\nx = 1\n```") == "from manim import *\nx = 1\n"
+
+
+def test_closing_fence_after_code_on_the_same_line():
+    assert extract("```python\nx = 1\ny = 2```\nmore prose") == "x = 1\ny = 2\n"
+
+
+def test_non_python_block_is_skipped():
+    response = "Install it with ```bash\npip install manim\n```\nthen:\n```py\nx = 1\n```"
+    assert extract(response) == "x = 1\n"
+
+
+def test_unfenced_code_is_taken_whole():
+    assert extract("from manim import *\nx = 1") == "from manim import *\nx = 1\n"
+
+
+def test_unterminated_block_is_accepted_at_end_of_stream():
+    assert extract("```python\nx = 1\n") == "x = 1\n"
+
+
+def test_feed_returns_code_once_block_closes():
+    extractor = CodeFenceExtractor()
+    assert extractor.feed("```python\nx = 1\n") is None
+    assert extractor.feed("```\ntrailing prose") == "x = 1\n"
+
+
+def test_valid_scene_needs_no_repairs():
+    ok, scene, _ = validate_scene_code("from manim import *\n\nclass Demo(Scene):\n    def construct(self):\n"
+                                       "        self.play(Create(Circle()))\n        self.wait()\n")
+    assert ok and scene.scene_name == 'Demo' and scene.repairs == [] and scene.animations == 2
+
+
+def test_missing_import_and_indentation_are_repaired():
+    ok, scene, _ = validate_scene_code("    class Demo(Scene):\n\t    def construct(self):\n\t\t    self.wait()\n")
+    assert ok and scene.repairs == ["normalized indentation", "added manim import"]
+    assert scene.code.startswith("from manim import *\n") and "\nclass Demo(Scene):\n" in scene.code
+
+
+def test_syntax_error_is_reported_with_its_line():
+    ok, scene, message = validate_scene_code("from manim import *\nclass Demo(Scene)\n    pass\n")
+    assert not ok and scene is None and "syntax error at line 2" in message
+
+
+def test_code_without_a_renderable_scene_is_rejected():
+    assert "does not define a Scene subclass" in validate_scene_code("x = 1\n")[2]
+    assert "has no construct() method" in validate_scene_code("class Demo(Scene):\n    pass\n")[2]
+
+
+def test_most_derived_scene_is_rendered():
+    code = ("class Base(Scene):\n    def construct(self):\n        self.wait()\n\n"
+            "class Demo(Base):\n    pass\n\n"
+            "class Helper:\n    pass\n")
+    ok, scene, _ = validate_scene_code(code)
+    assert ok and scene.scene_name == 'Demo'
+
+
+def test_animation_count_is_unknown_for_loops_and_helpers():
+    loop = "class Demo(Scene):\n    def construct(self):\n        for _ in range(3):\n            self.wait()\n"
+    helper = "class Demo(Scene):\n    def construct(self):\n        animate(self)\n"
+    assert validate_scene_code(loop)[1].animations is None
+    assert validate_scene_code(helper)[1].animations is None
@@ -0,0 +1,91 @@
+import pytest
+from flask import Flask, abort
+
+from video_index import OFFLOAD_ACCEL, OFFLOAD_SENDFILE, VideoIndex
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def video_dir(tmp_path):
+    videos = tmp_path / 'videos'
+    videos.mkdir()
+    (videos / 'demo.mp4').write_bytes(CONTENT)
+    (tmp_path / 'secret.mp4').write_bytes(b'secret')
+    return videos
+
+
+def make_client(index: VideoIndex):
+    app = Flask(__name__)
+
+    @app.route('/videos/<path:name>')
+    def video(name):
+        entry = index.get(name)
+        if entry is None:
+            abort(404)
+        return index.send(entry)
+
+    return app.test_client()
+
+
+def test_full_response_with_validators(video_dir):
+    index = VideoIndex(video_dir)
+    response = make_client(index).get('/videos/demo.mp4')
+    assert response.status_code == 200 and response.data == CONTENT
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag'] == f'"{index.get("demo.mp4").etag}"'
+    assert response.headers['Last-Modified']
+
+
+def test_range_request_returns_only_the_slice(video_dir):
+    response = make_client(VideoIndex(video_dir)).get('/videos/demo.mp4', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206 and response.data == CONTENT[10:20]
+    assert response.headers['Content-Range'] == f"bytes 10-19/{len(CONTENT)}"
+
+
+def test_unsatisfiable_range(video_dir):
+    index = VideoIndex(video_dir)
+    response = make_client(index).get('/videos/demo.mp4', headers={'Range': f'bytes={len(CONTENT) + 10}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f"bytes */{len(CONTENT)}"
+    assert index.stats()['responses']['416'] == 1
+
+
+def test_conditional_requests_are_not_modified(video_dir):
+    client = make_client(VideoIndex(video_dir))
+    first = client.get('/videos/demo.mp4')
+    by_etag = client.get('/videos/demo.mp4', headers={'If-None-Match': first.headers['ETag']})
+    by_date = client.get('/videos/demo.mp4', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert by_etag.status_code == 304 and by_etag.data == b''
+    assert by_date.status_code == 304
+    assert client.get('/videos/demo.mp4', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize('offload, header, value', [
+    (OFFLOAD_ACCEL, 'X-Accel-Redirect', '/internal/videos/demo.mp4'),
+    (OFFLOAD_SENDFILE, 'X-Sendfile', None),
+])
+def test_offload_hands_the_file_to_the_proxy(video_dir, offload, header, value):
+    response = make_client(VideoIndex(video_dir, offload=offload)).get('/videos/demo.mp4')
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers[header] == (value or str((video_dir / 'demo.mp4').resolve()))
+
+
+def test_only_existing_files_inside_the_directory_are_served(video_dir):
+    index = VideoIndex(video_dir)
+    assert index.get('../secret.mp4') is None
+    assert index.get('missing.mp4') is None
+    assert make_client(index).get('/videos/missing.mp4').status_code == 404
+    assert index.get('demo.mp4').size == len(CONTENT)
+
+
+def test_non_ascii_download_names_are_encoded(video_dir):
+    index = VideoIndex(video_dir)
+    app = Flask(__name__)
+    with app.test_request_context('/'):
+        response = index.send(index.get('demo.mp4'), as_attachment=True, download_name='math_video_∫_dx.mp4')
+    disposition = response.headers['Content-Disposition']
+    disposition.encode('latin-1')
+    assert disposition.startswith('attachment; filename=math_video__dx.mp4;')
+    assert "filename*=UTF-8''math_video_%E2%88%AB_dx.mp4" in disposition
+    response.close()
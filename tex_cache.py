@@ -0,0 +1,143 @@
+"""
+Shared cache of LaTeX expressions compiled by Manim.
+Every render writes its Tex files into its own media directory, so identical
+MathTex strings would be recompiled through latex and dvisvgm for each video.
+Warm render workers hard-link a shared SVG into the render's Tex directory as
+soon as Manim names the expression it needs (see render_server.py), which
+Manim then picks up instead of compiling; after the render newly compiled
+SVGs are published back atomically. The shared directory is evicted
+least-recently-used once it grows past its size budget.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from render_cache import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+
+class TexCache:
+    """Size-bounded LRU store of compiled TeX SVGs shared by all render workers"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # SVG file name -> size in bytes, least recently used first
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+
+        existing = sorted(self.cache_dir.glob("*.svg"), key=lambda p: p.stat().st_mtime)
+        for svg in existing:
+            self._entries[svg.name] = svg.stat().st_size
+        logger.info(f"TeX cache at {self.cache_dir.absolute()}: {len(self._entries)} expressions, "
+                    f"{self.total_bytes} bytes (limit {self.max_bytes})")
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._entries.values())
+
+    @staticmethod
+    def link_cached(cache_dir: Path, tex_file: Path) -> Optional[Path]:
+        """Link the cached SVG for a Manim .tex file next to it, if there is one; returns the SVG path.
+
+        Called from render workers, which only read the shared directory.
+        """
+        svg = tex_file.with_suffix(".svg")
+        if svg.exists():
+            return svg
+        try:
+            link_or_copy(Path(cache_dir) / svg.name, svg)
+        except FileNotFoundError:
+            return None  # not cached, or evicted since
+        return svg
+
+    def collect(self, tex_dir: Path):
+        """Count hits for expressions served from the cache and publish newly compiled ones"""
+        if not tex_dir.is_dir():
+            return
+        hits = misses = 0
+        # Manim writes a .tex source for every expression it uses, compiled or not
+        for tex_file in tex_dir.glob("*.tex"):
+            name = f"{tex_file.stem}.svg"
+            svg = tex_dir / name
+            if not svg.exists():
+                continue
+            if self._is_cached_copy(svg):
+                hits += 1
+                self._touch(name)
+            else:
+                misses += 1
+                self._publish(svg)
+
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self._evict()
+        if hits or misses:
+            logger.info(f"TeX cache: {hits} expressions reused, {misses} compiled in {tex_dir}")
+
+    def _is_cached_copy(self, svg: Path) -> bool:
+        """Whether an SVG in a render's Tex directory is a link to the shared one"""
+        try:
+            return os.path.samefile(svg, self.cache_dir / svg.name)
+        except FileNotFoundError:
+            return False
+
+    def _touch(self, name: str):
+        """Mark an SVG as recently used"""
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                try:
+                    os.utime(self.cache_dir / name)  # keep LRU order across restarts
+                except FileNotFoundError:
+                    self._entries.pop(name)
+
+    def _publish(self, svg: Path):
+        """Atomically add a compiled SVG to the shared directory"""
+        path = self.cache_dir / svg.name
+        tmp_path = path.with_name(f"{svg.stem}.{threading.get_ident()}.tmp")
+        try:
+            size = svg.stat().st_size
+            link_or_copy(svg, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to cache TeX SVG {svg}: {e}")
+            return
+        with self._lock:
+            self._entries[svg.name] = size
+            self._entries.move_to_end(svg.name)
+
+    def _evict(self):
+        """Remove least recently used SVGs until under the size limit"""
+        while self._entries and self.total_bytes > self.max_bytes:
+            name, size = self._entries.popitem(last=False)
+            try:
+                (self.cache_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+            self.evictions += 1
+            logger.debug(f"Evicted cached TeX SVG {name} ({size} bytes)")
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+            }
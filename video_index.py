@@ -0,0 +1,170 @@
+"""
+In-memory index of finished videos and HTTP delivery from it.
+Size, modification time and a content hash are recorded once per video, so
+playback requests are answered with 304 Not Modified or 206 Partial Content
+without re-statting the file or reading it beyond the requested range. The
+file transfer itself can be handed to a front proxy with X-Accel-Redirect
+(nginx) or X-Sendfile (Apache, lighttpd).
+"""
+
+import hashlib
+import logging
+import threading
+import unicodedata
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+
+from metrics import VIDEO_RESPONSES
+
+logger = logging.getLogger(__name__)
+
+OFFLOAD_ACCEL = 'x-accel'
+OFFLOAD_SENDFILE = 'x-sendfile'
+
+
+class VideoEntry:
+    """Metadata of one finished video"""
+
+    def __init__(self, path: Path, size: int, mtime: float, etag: str):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+
+    @property
+    def last_modified(self) -> datetime:
+        return datetime.fromtimestamp(int(self.mtime), tz=timezone.utc)
+
+
+class VideoIndex:
+    """Metadata of the videos in a directory, recorded once per file"""
+
+    def __init__(self, video_dir: Path, offload: str = '', accel_prefix: str = '/internal/videos/',
+                 max_age: int = 86400):
+        self.video_dir = Path(video_dir).resolve()
+        self.offload = offload
+        self.accel_prefix = accel_prefix
+        self.max_age = max_age
+        self._entries: Dict[str, VideoEntry] = {}
+        self._lock = threading.Lock()
+        self._responses = {200: 0, 206: 0, 304: 0, 416: 0}
+
+    @staticmethod
+    def hash_file(path: Path) -> str:
+        """Content hash used as a strong ETag"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:32]
+
+    def add(self, path: Path) -> VideoEntry:
+        """Record a finished video's size, mtime and hash"""
+        path = Path(path).resolve()
+        stat = path.stat()
+        entry = VideoEntry(path, stat.st_size, stat.st_mtime, self.hash_file(path))
+        with self._lock:
+            self._entries[path.name] = entry
+        logger.info(f"Indexed video {path.name} ({entry.size} bytes, etag {entry.etag[:12]})")
+        return entry
+
+    def get(self, name: str) -> Optional[VideoEntry]:
+        """Look up a video by file name, indexing it on first sight"""
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry:
+            return entry
+        path = self.video_dir / name
+        if path.parent != self.video_dir or not path.is_file():
+            return None
+        return self.add(path)
+
+    def remove(self, name: str):
+        """Forget a video that was deleted"""
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def send(self, entry: VideoEntry, as_attachment: bool = False,
+             download_name: Optional[str] = None) -> Response:
+        """Respond with a video, honouring conditional and Range requests"""
+        if not is_resource_modified(request.environ, etag=entry.etag, last_modified=entry.last_modified):
+            response = Response(status=304)
+            self._add_validators(response, entry)
+            self._count(304)
+            return response
+
+        if self.offload:
+            # The proxy reads the file and answers Range requests itself
+            response = Response(mimetype='video/mp4')
+            if self.offload == OFFLOAD_ACCEL:
+                response.headers['X-Accel-Redirect'] = self.accel_prefix + entry.path.name
+            else:
+                response.headers['X-Sendfile'] = str(entry.path)
+            self._add_validators(response, entry)
+            self._add_disposition(response, entry, as_attachment, download_name)
+            self._count(200)
+            return response
+
+        try:
+            file = open(entry.path, 'rb')
+        except FileNotFoundError:
+            self.remove(entry.path.name)
+            raise
+        response = Response(wrap_file(request.environ, file), mimetype='video/mp4', direct_passthrough=True)
+        response.content_length = entry.size
+        self._add_validators(response, entry)
+        self._add_disposition(response, entry, as_attachment, download_name)
+        try:
+            # Slices the open file for Range requests
+            response.make_conditional(request, accept_ranges=True, complete_length=entry.size)
+        except RequestedRangeNotSatisfiable:
+            file.close()
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{entry.size}"
+            self._count(416)
+            return response
+        self._count(response.status_code)
+        return response
+
+    def _add_validators(self, response: Response, entry: VideoEntry):
+        response.set_etag(entry.etag)
+        response.last_modified = entry.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+
+    @staticmethod
+    def _add_disposition(response: Response, entry: VideoEntry, as_attachment: bool,
+                         download_name: Optional[str]):
+        """Content-Disposition as send_file writes it, with an RFC 5987 filename* for non-ASCII names"""
+        filename = download_name or entry.path.name
+        try:
+            filename.encode('ascii')
+        except UnicodeEncodeError:
+            simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+            names = {'filename': simple, 'filename*': f"UTF-8''{quote(filename, safe='!#$&+-.^_`|~')}"}
+        else:
+            names = {'filename': filename}
+        kind = 'attachment' if as_attachment else 'inline'
+        response.headers.set('Content-Disposition', kind, **names)
+
+    def _count(self, status: int):
+        VIDEO_RESPONSES.inc(status=status)
+        with self._lock:
+            self._responses[status] = self._responses.get(status, 0) + 1
+
+    def stats(self) -> Dict:
+        """Number of indexed videos and responses by status code"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(entry.size for entry in self._entries.values()),
+                'responses': {str(status): count for status, count in self._responses.items()},
+                'offload': self.offload or None,
+            }
@@ -0,0 +1,91 @@
+"""
+Post-render processing of finished Manim videos for web playback.
+Manim writes the moov atom at the end of the MP4, so a browser has to fetch
+the whole file before it can start playing. Every render is remuxed with
+faststart (stream copy, no re-encode), and can optionally be transcoded to a
+smaller web profile such as 720p30 at a CRF quality target.
+"""
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Optional, Tuple
+
+from metrics import ENCODE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PATTERN = re.compile(r'^(\d+)p(\d+)$')  # e.g. 720p30, as in Manim's quality directories
+
+
+def parse_profile(profile: str) -> Optional[Tuple[int, int]]:
+    """Height and frame rate of a profile such as 720p30, or None if it is not one"""
+    match = PROFILE_PATTERN.match(profile.strip()) if profile else None
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+class VideoPostProcessor:
+    """Remuxes rendered videos with faststart and optionally transcodes them to a web profile"""
+
+    def __init__(self, faststart: bool = True, web_profile: str = '', crf: int = 23, preset: str = 'veryfast',
+                 timeout: int = 300):
+        self.faststart = faststart
+        self.web_profile = parse_profile(web_profile)
+        if web_profile and not self.web_profile:
+            logger.warning(f"Ignoring invalid web profile {web_profile!r}, expected e.g. 720p30")
+        self.crf = crf
+        self.preset = preset
+        self.timeout = timeout
+        self.ffmpeg_available = shutil.which("ffmpeg") is not None
+        if (self.faststart or self.web_profile) and not self.ffmpeg_available:
+            logger.warning("ffmpeg not found, rendered videos are served as Manim wrote them")
+
+    @property
+    def enabled(self) -> bool:
+        return self.ffmpeg_available and (self.faststart or self.web_profile is not None)
+
+    def needs_transcode(self, resolution: str) -> bool:
+        """Whether a render at e.g. 1080p60 exceeds the web profile"""
+        source = parse_profile(resolution)
+        if not self.web_profile or not source:
+            return False
+        return source[0] > self.web_profile[0] or source[1] > self.web_profile[1]
+
+    def process(self, video_path: Path, resolution: str) -> Tuple[bool, Path, str]:
+        """Optimize a video in place (by rename); returns success, resulting path, and message"""
+        if not self.enabled:
+            return True, video_path, "Post-processing disabled"
+
+        output_path = video_path.with_name(f"{video_path.stem}.web.mp4")
+        if self.needs_transcode(resolution):
+            height, fps = self.web_profile
+            # Only ever scale down; -2 keeps the width even as x264 requires
+            codec_args = ["-vf", f"scale=-2:'min({height},ih)',fps={fps}", "-c:v", "libx264",
+                          "-preset", self.preset, "-crf", str(self.crf), "-pix_fmt", "yuv420p", "-c:a", "copy"]
+            action = f"transcoded {resolution} to {height}p{fps} CRF {self.crf}"
+            step = 'transcode'
+        else:
+            codec_args = ["-c", "copy"]
+            action = "remuxed with faststart"
+            step = 'faststart'
+
+        cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(video_path), *codec_args,
+               "-movflags", "+faststart", str(output_path)]
+        try:
+            with ENCODE_SECONDS.time(step=step):
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            output_path.unlink(missing_ok=True)
+            return False, video_path, f"ffmpeg post-processing timed out after {self.timeout} seconds"
+        if result.returncode != 0 or not output_path.exists() or output_path.stat().st_size == 0:
+            output_path.unlink(missing_ok=True)
+            return False, video_path, f"ffmpeg post-processing failed: {result.stderr}"
+
+        before = video_path.stat().st_size
+        os.replace(output_path, video_path)
+        after = video_path.stat().st_size
+        logger.info(f"Post-processed {video_path.name}: {action}, {before} -> {after} bytes")
+        return True, video_path, action
@@ -0,0 +1,141 @@
+"""
+Per-render scratch workspaces and disk garbage collection.
+Each render writes its scene source, Manim media, partial movie files and
+Tex output into its own workspace, which is deleted as soon as the final MP4
+has been moved out. A background thread removes workspaces left behind by
+crashed renders and enforces a maximum age and total size on finished videos.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class WorkspaceManager:
+    """Creates render workspaces and garbage-collects render output in the background"""
+
+    def __init__(self, workspace_root: Path, video_dir: Path, source_dir: Optional[Path] = None,
+                 max_video_age: int = 0, max_video_bytes: int = 0, max_workspace_age: int = 3600,
+                 interval: int = 600, on_video_removed: Optional[Callable[[Path], None]] = None):
+        self.workspace_root = Path(workspace_root)
+        self.workspace_root.mkdir(parents=True, exist_ok=True)
+        self.video_dir = Path(video_dir)
+        self.video_dir.mkdir(parents=True, exist_ok=True)
+        self.source_dir = Path(source_dir) if source_dir else None
+        self.max_video_age = max_video_age  # seconds, 0 keeps videos forever
+        self.max_video_bytes = max_video_bytes  # 0 for no quota
+        self.max_workspace_age = max_workspace_age
+        self.interval = interval
+        self.on_video_removed = on_video_removed
+        self._active: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'runs': 0, 'workspaces_removed': 0, 'videos_removed': 0, 'bytes_freed': 0}
+
+    @contextmanager
+    def workspace(self, name: str) -> Iterator[Path]:
+        """Scratch directory for one render, removed with everything in it on exit"""
+        path = self.workspace_root / name
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._active.add(name)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._active.discard(name)
+            logger.info(f"Removed render workspace {path}")
+
+    def start(self):
+        """Run garbage collection periodically in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="disk-gc", daemon=True)
+            self._thread.start()
+            logger.info(f"Disk garbage collection every {self.interval}s: videos max age "
+                        f"{self.max_video_age}s, quota {self.max_video_bytes} bytes")
+
+    def _loop(self):
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error(f"Disk garbage collection failed: {e}", exc_info=True)
+            time.sleep(self.interval)
+
+    def collect(self) -> Dict:
+        """Remove stale workspaces, expired videos and the oldest videos over quota"""
+        now = time.time()
+        removed_workspaces = removed_videos = freed = 0
+
+        with self._lock:
+            active = set(self._active)
+        for path in self.workspace_root.iterdir():
+            try:
+                if path.name in active or now - path.stat().st_mtime < self.max_workspace_age:
+                    continue
+            except FileNotFoundError:
+                continue  # its render finished and removed it since the listing
+            shutil.rmtree(path, ignore_errors=True)
+            removed_workspaces += 1
+            logger.info(f"Removed stale render workspace {path}")
+
+        videos = sorted(self._list_videos(), key=lambda item: item[1].st_mtime)
+        total = sum(stat.st_size for _, stat in videos)
+        for path, stat in videos:
+            expired = self.max_video_age and now - stat.st_mtime > self.max_video_age
+            over_quota = self.max_video_bytes and total > self.max_video_bytes
+            if not (expired or over_quota):
+                break  # videos are oldest first, so the rest are newer and within quota
+            self._remove_video(path)
+            total -= stat.st_size
+            freed += stat.st_size
+            removed_videos += 1
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['workspaces_removed'] += removed_workspaces
+            self._stats['videos_removed'] += removed_videos
+            self._stats['bytes_freed'] += freed
+        if removed_workspaces or removed_videos:
+            logger.info(f"Disk GC removed {removed_workspaces} workspaces and {removed_videos} videos, "
+                        f"freed {freed} bytes")
+        return {'workspaces_removed': removed_workspaces, 'videos_removed': removed_videos, 'bytes_freed': freed}
+
+    def _list_videos(self) -> List[Tuple[Path, os.stat_result]]:
+        """Finished videos with their stat, skipping any deleted while listing"""
+        videos = []
+        for path in self.video_dir.glob("*.mp4"):
+            try:
+                videos.append((path, path.stat()))
+            except FileNotFoundError:
+                pass
+        return videos
+
+    def _remove_video(self, path: Path):
+        """Delete a finished video and its kept scene source"""
+        path.unlink(missing_ok=True)
+        if self.on_video_removed:
+            self.on_video_removed(path)
+        if self.source_dir:
+            (self.source_dir / f"{path.stem}.py").unlink(missing_ok=True)
+        logger.info(f"Removed video {path.name}")
+
+    def stats(self) -> Dict:
+        """Garbage collection totals and current disk usage of render output"""
+        video_bytes = sum(stat.st_size for _, stat in self._list_videos())
+        with self._lock:
+            return {
+                **self._stats,
+                'active_workspaces': len(self._active),
+                'video_bytes': video_bytes,
+                'max_video_bytes': self.max_video_bytes,
+                'max_video_age': self.max_video_age,
+            }